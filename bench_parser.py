@@ -0,0 +1,72 @@
+"""
+页面解析微基准
+对比原先的BeautifulSoup完整建树方式与page_parser的流式头部解析 + 正则链接扫描。
+
+用法：python bench_parser.py <保存的页面目录> [重复次数]
+目录下的每个文件视为一个页面（utf-8解码，无法解码的字节忽略）。
+"""
+import sys
+from pathlib import Path
+from time import perf_counter
+from typing import Callable
+
+from bs4 import BeautifulSoup
+
+from page_parser import extract_head, extract_links
+
+
+def bs4_parse(text: str) -> tuple[dict[str, str | None], list[str]]:
+    soup = BeautifulSoup(text, 'html.parser')
+    keywords = soup.find('meta', attrs={"name": "keywords"})
+    description = soup.find('meta', attrs={"name": "description"})
+    title = soup.find('title')
+    head = {
+        'title': title.text if title else None,
+        'keywords': keywords.get('content') if keywords else None,
+        'description': description.get('content') if description else None,
+    }
+    return head, [a['href'] for a in soup.find_all('a', href=True)]
+
+
+def fast_parse(text: str) -> tuple[dict[str, str | None], list[str]]:
+    head = extract_head(text)
+    head.pop('canonical')
+    return head, extract_links(text)
+
+
+def _bench(parse: Callable, pages: list[str], repeat: int) -> float:
+    t = perf_counter()
+    for _ in range(repeat):
+        for page in pages:
+            parse(page)
+    return (perf_counter() - t) / (repeat * len(pages))
+
+
+def main() -> None:
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    pages = [path.read_bytes().decode('utf-8', errors='ignore')
+             for path in sorted(Path(sys.argv[1]).iterdir()) if path.is_file()]
+    if not pages:
+        print('目录下没有页面')
+        sys.exit(1)
+
+    same_head = same_links = 0
+    for page in pages:
+        bs4_head, bs4_links = bs4_parse(page)
+        head, links = fast_parse(page)
+        same_head += bs4_head == head
+        same_links += bs4_links == links
+
+    bs4_time = _bench(bs4_parse, pages, repeat)
+    fast_time = _bench(fast_parse, pages, repeat)
+    print(f'页面数：{len(pages)}，平均大小：{sum(map(len, pages)) / len(pages) / 1024:.1f}KB，重复{repeat}次')
+    print(f'BeautifulSoup：{bs4_time * 1000:.3f}ms/页')
+    print(f'page_parser：  {fast_time * 1000:.3f}ms/页（{bs4_time / fast_time:.1f}倍）')
+    print(f'头部信息一致：{same_head}/{len(pages)}，链接一致：{same_links}/{len(pages)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+import re
+from urllib.parse import urljoin, urlsplit, urlunsplit, unquote_plus, quote
+
+from config import url_tracking_params, url_strip_trailing_slash
+
+_default_ports = {'http': 80, 'https': 443}
+_unreserved = set('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-._~')
+_percent_pattern = re.compile(r'%([0-9a-fA-F]{2})')
+_path_safe = "/%:@!$&'()*+,;=-._~"
+_query_safe = "%:@!$'()*+,;=/?-._~"
+_stray_percent_pattern = re.compile(r'%(?![0-9a-fA-F]{2})')
+
+_tracking_names = {param for param in url_tracking_params if not param.endswith('*')}
+_tracking_prefixes = tuple(param[:-1] for param in url_tracking_params if param.endswith('*'))
+
+
+def _normalize_percent(text: str) -> str:
+    """
+    非保留字符的百分号编码解码，其余的百分号编码统一为大写
+    """
+
+    def repl(match: re.Match) -> str:
+        char = chr(int(match.group(1), 16))
+        if char in _unreserved:
+            return char
+        return '%' + match.group(1).upper()
+
+    return _percent_pattern.sub(repl, text)
+
+
+def _quote(text: str, safe: str) -> str:
+    """
+    编码不能出现在链接中的字符，已有的百分号编码保持不变，不是编码的%写为%25
+    """
+    return _normalize_percent(quote(_stray_percent_pattern.sub('%25', text), safe=safe))
+
+
+def _normalize_query(query: str) -> str:
+    """
+    查询参数不解码，按名称排序各个name=value后重新用&连接，只统一百分号编码
+    解码后再编码会改变请求的资源，例如c%2B%2B变为c++（服务器读作空格）
+    """
+    params = [param for param in query.split('&') if param and not _is_tracking(unquote_plus(param.split('=', 1)[0]))]
+    params = [_quote(param, _query_safe) for param in params]
+    params.sort(key=lambda param: param.split('=', 1)[0])
+    return '&'.join(params)
+
+
+def _remove_dot_segments(path: str) -> str:
+    """
+    RFC 3986 5.2.4，去掉路径中的 . 和 ..
+    """
+    output: list[str] = []
+    segments = path.split('/')
+    for segment in segments[1:]:
+        if segment == '.':
+            continue
+        if segment == '..':
+            if output:
+                output.pop()
+            continue
+        output.append(segment)
+    if segments[-1] in ('.', '..'):
+        output.append('')
+    return '/' + '/'.join(output)
+
+
+def _is_tracking(name: str) -> bool:
+    name = name.lower()
+    return name in _tracking_names or name.startswith(_tracking_prefixes)
+
+
+def canonicalize(url: str, base: str | None = None) -> str | None:
+    """
+    链接规范化，用于入队和去重
+    相对链接以base（所在页面的链接）为基础补全；scheme和域名转为小写，去掉默认端口、片段和跟踪参数，
+    路径去掉 . 和 ..、合并连续的/、统一百分号编码，查询参数不解码，按名称排序。
+    :return: 规范化后的链接，不是http(s)链接时返回None
+    """
+    url = url.strip()
+    if base:
+        url = urljoin(base, url)
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return None
+
+    scheme = parts.scheme.lower()
+    if scheme not in _default_ports or not parts.hostname:
+        return None
+
+    host = parts.hostname.rstrip('.')
+    try:
+        host = host.encode('idna').decode('ascii')
+    except UnicodeError:
+        pass
+    host = host.lower()
+    if ':' in host:  # IPv6
+        host = f'[{host}]'
+    netloc = host
+    if parts.username is not None:
+        userinfo = parts.username + (f':{parts.password}' if parts.password is not None else '')
+        netloc = f'{userinfo}@{netloc}'
+    if port is not None and port != _default_ports[scheme]:
+        netloc = f'{netloc}:{port}'
+
+    path = _quote(parts.path, _path_safe)
+    path = re.sub(r'/{2,}', '/', path)
+    path = _remove_dot_segments(path) if path else '/'
+    if url_strip_trailing_slash and len(path) > 1 and path.endswith('/'):
+        path = path.rstrip('/') or '/'
+
+    query = _normalize_query(parts.query)
+
+    return urlunsplit((scheme, netloc, path, query, ''))
@@ -8,16 +8,81 @@ engine_name_en = 'TY-Spider'
 bfs_depth: int = 50  # bfs抓取深度
 wiki: str = 'https://zh.wikipedia.org'
 
+storage_backend: str = 'mongodb'  # 数据存储，'mongodb'或'sqlite'（嵌入式，不需要运行mongod）
+storage_file: str = 'storage.db'  # 使用sqlite时./temp下的数据库文件名
+
 mongodb_host: str = '127.0.0.1'
 mongodb_port: int = 27017
+mongodb_pool_size: int = 50  # 每个进程与MongoDB的最大连接数
 db_name: str = 'TY_Spider'
 data_col_name: str = 'sites'
 key_col_name: str = 'keys'
+terms_col_name: str = 'doc_terms'  # 每个页面被索引的关键词，增量索引时用来找出不再出现的关键词
+meta_col_name: str = 'meta'  # 增量索引的进度等元数据
+mongodb_bulk_size: int = 500  # 爬虫攒够多少条数据批量写入一次
+mongodb_bulk_interval: float = 5  # 爬虫最多每隔多少秒批量写入一次
 
 bloom_dataSize: int = 100000000  # 布隆过滤器数据量
 bloom_errorRate: float = 0.001  # 布隆过滤器错误率
+bloom_flushInterval: int = 1000  # 布隆过滤器每添加多少条数据同步一次磁盘
+bloom_scalable: bool = False  # 是否使用可扩展布隆过滤器，开启后bloom_dataSize为第一个切片的容量，写满后自动扩容
 
 spider_check_memory = True  # 爬虫模块是否检测内存占用情况
+governor_low_memory: float = 0.2  # 可用内存比例低于该值时开始降低爬虫并发
+governor_min_memory: float = 0.05  # 可用内存比例低于该值时爬虫只保留1个并发
+governor_max_rss: int = 0  # 爬虫进程RSS上限（MB），0为不限制
+governor_max_sockets: int = 0  # 爬虫进程打开的socket数上限，0为不限制
+governor_interval: float = 2  # 资源采样间隔（秒）
+spider_workers: int = 2  # 爬虫进程数，链接按域名分配给各进程
+spider_seeds: list[str] = [wiki, 'https://www.asxe.vip']  # 爬虫根站
+spider_concurrency: int = 32  # 异步爬虫同时进行的抓取数
+spider_host_concurrency: int = 2  # 同一域名同时进行的抓取数
+spider_host_delay: float = 0.5  # 同一域名两次请求的最小间隔（秒）
+fetch_timeout: float = 4  # 请求超时时间（秒）
+fetch_retries: int = 2  # 连接失败、超时和429、5xx响应的重试次数
+fetch_backoff: float = 0.5  # 重试等待时间的基数（秒），第n次重试等待 fetch_backoff * 2^n
+fetch_pool_hosts: int = 100  # requests连接池缓存的域名数
+fetch_pool_size: int = 10  # 每个域名保留的长连接数
+fetch_dns_ttl: int = 300  # DNS缓存时间（秒），0为不缓存
+fetch_dns_cache_size: int = 1024  # DNS缓存最多保存的域名数，超过后淘汰最久未使用的
+fetch_max_bytes: int = 2 * 1024 * 1024  # 每个页面最多读取的字节数，超过的部分丢弃
+fetch_accept: str = 'text/html,application/xhtml+xml;q=0.9,*/*;q=0.1'  # 请求头中的Accept
+fetch_html_types: list[str] = ['text/html', 'application/xhtml+xml']  # 视为HTML页面的Content-Type
+url_skip_extensions: list[str] = ['.pdf', '.jpg', '.jpeg', '.png', '.gif', '.webp', '.svg', '.ico', '.bmp', '.mp3',
+                                  '.mp4', '.avi', '.mov', '.flv', '.zip', '.rar', '.7z', '.gz', '.tar', '.exe',
+                                  '.apk', '.dmg', '.iso', '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx', '.css',
+                                  '.js', '.woff', '.woff2', '.ttf']  # 不入队的链接后缀
+frontier_hot_size: int = 1000  # 爬虫队列在内存中保留的链接数，其余保存在磁盘
+frontier_compact_interval: int = 100  # 爬虫队列每处理完多少个链接清理一次已处理完的链接
+frontier_depth_decay: float = 0.8  # 爬虫队列中链接的分数每深一层乘以该值
+url_tracking_params: list[str] = ['utm_*', 'spm', 'fbclid', 'gclid', 'yclid', 'msclkid', 'mc_cid', 'mc_eid', '_hsenc',
+                                  '_hsmi', 'ref_src']  # 链接规范化时去掉的跟踪参数，以*结尾表示前缀
+url_strip_trailing_slash: bool = False  # 链接规范化时是否去掉路径末尾的/，开启后/docs/会按/docs抓取
+robots_ttl: int = 86400  # robots.txt缓存时间（秒）
+robots_negative_ttl: int = 3600  # 不存在的robots.txt缓存时间（秒）
+robots_error_ttl: int = 600  # robots.txt返回5xx或无法访问时暂时禁止抓取该域名的时间（秒）
+simhash_bands: int = 4  # SimHash索引把64位指纹分成几段
+simhash_distance: int = 3  # 汉明距离不超过该值的页面视为近似重复，必须小于simhash_bands
+simhash_body: bool = True  # 计算SimHash时是否包含正文文本
+simhash_body_size: int = 20000  # 参与计算SimHash的正文最大字符数
+recrawl_initial_interval: int = 86400  # 新页面的首次重抓间隔（秒）
+recrawl_min_interval: int = 3600  # 重抓间隔下限（秒）
+recrawl_max_interval: int = 30 * 86400  # 重抓间隔上限（秒）
+recrawl_history: int = 20  # 估计变化频率时参考的最近检查次数
+recrawl_batch: int = 5000  # 每次重抓最多处理的到期页面数
+index_batch_size: int = 1000  # 建立索引时每次处理的页面数
+index_workers: int = 0  # 建立索引时的分词进程数，0为CPU核数
+index_flush_size: int = 1000000  # 内存中累计多少条倒排记录的变更后写入一次
+postings_block_size: int = 128  # 倒排记录每多少个文档编号为一块，每块在跳表中有一个指针
+index_lag: float = 60  # 增量索引从上次开始时间前多少秒开始检查，避免漏掉上次运行时还未写入的页面
+bm25_k1: float = 1.2  # BM25词频饱和参数
+bm25_b: float = 0.75  # BM25字段长度归一化参数
+bm25_boosts: dict[str, float] = {'title': 3.0, 'keywords': 2.0, 'description': 1.0}  # BM25各字段的权重
+segment_dir: str = 'index'  # ./temp下保存索引段的目录
+segment_keep: int = 2  # 保留最近几代索引段，更早的删除
+segment_reload_interval: float = 5  # 后端服务每隔多少秒检查一次是否发布了新的索引段
+doc_cache_size: int = 10000  # 后端服务按文档编号缓存最近查询过的页面数，0为不缓存
+doc_cache_ttl: float = 300  # 缓存的页面超过多少秒后重新读取
 
 fastapi_port: int = 1314
 
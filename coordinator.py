@@ -0,0 +1,171 @@
+import asyncio
+import bisect
+import multiprocessing
+import queue
+import time
+from multiprocessing.context import SpawnContext
+from typing import Any
+
+import mmh3
+from loguru import logger
+
+from config import bfs_depth, spider_seeds, spider_workers
+from crawler import AsyncCrawler
+from log_lg import SpiderLog
+from utils import ParserLink
+
+Item = tuple[str, int, float | None]
+
+
+class HashRing:
+    """
+    一致性哈希环，按域名把链接分配给固定的worker
+    每个worker在环上有replicas个虚拟节点，使域名分布更均匀
+    """
+
+    def __init__(self, nodes: int, replicas: int = 64):
+        points = sorted(
+            (mmh3.hash(f'{node}-{replica}', signed=False), node)
+            for node in range(nodes)
+            for replica in range(replicas)
+        )
+        self._keys = [point[0] for point in points]
+        self._nodes = [point[1] for point in points]
+
+    def owner(self, url: str) -> int:
+        host = ParserLink(url).netloc.lower()
+        i = bisect.bisect(self._keys, mmh3.hash(host, signed=False)) % len(self._keys)
+        return self._nodes[i]
+
+
+class ShardCrawler(AsyncCrawler):
+    """
+    分片爬虫
+    只抓取属于自己的域名，队列和布隆过滤器文件都以分片编号命名，
+    发现的其他分片的链接通过对应分片的队列发送过去，由对方去重后入队。
+    """
+
+    def __init__(self, shard: int, ring: HashRing, seeds: list[str], target_depth: int,
+                 inboxes: list[Any], idle: Any, sent: Any, received: Any, stop: Any):
+        super().__init__(seeds[0] if seeds else '', f'shard-{shard}', target_depth, seeds=seeds)
+        self.shard = shard
+        self.ring = ring
+        self._inboxes = inboxes
+        self._idle_flags = idle
+        self._sent = sent
+        self._received = received
+        self._stop = stop
+
+    async def run(self) -> None:
+        pump = asyncio.create_task(self._pump())
+        try:
+            await super().run()
+        finally:
+            pump.cancel()
+
+    async def _pump(self) -> None:
+        """
+        接收其他分片发来的链接
+        """
+        inbox = self._inboxes[self.shard]
+        while True:
+            try:
+                items = inbox.get_nowait()
+            except queue.Empty:
+                if self._stop.is_set():
+                    self._wakeup.set()
+                    return
+                await asyncio.sleep(0.1)
+                continue
+            # 先标记为忙碌再计数，协调进程看到收发数量相等时，该分片一定已不再空闲
+            self._idle_flags[self.shard] = 0
+            await self._queue_call(self.queue.push_many, items)
+            with self._received.get_lock():
+                self._received.value += 1
+            self._wakeup.set()
+
+    def _idle(self) -> bool:
+        self._idle_flags[self.shard] = 1
+        return self._stop.is_set()
+
+    def _push(self, items: list[Item]) -> None:
+        shards: dict[int, list[Item]] = {}
+        for item in items:
+            shards.setdefault(self.ring.owner(item[0]), []).append(item)
+        for shard, shard_items in shards.items():
+            if shard == self.shard:
+                self.queue.push_many(shard_items)
+                continue
+            with self._sent.get_lock():
+                self._sent.value += 1
+            self._inboxes[shard].put(shard_items)
+
+
+def _run_shard(shard: int, workers: int, seeds: list[str], target_depth: int,
+               inboxes: list[Any], idle: Any, sent: Any, received: Any, stop: Any) -> None:
+    crawler = ShardCrawler(shard, HashRing(workers), seeds, target_depth, inboxes, idle, sent, received, stop)
+    try:
+        asyncio.run(crawler.run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for inbox in inboxes:
+            inbox.cancel_join_thread()
+
+
+class Coordinator:
+    """
+    爬虫协调进程
+    启动workers个爬虫进程，按域名的一致性哈希划分链接，每个进程独占自己的队列和布隆过滤器。
+    所有分片都空闲、且发出与收到的链接批次数相等并连续两次检查不变时，通知所有分片结束。
+    """
+
+    def __init__(self, seeds: list[str], target_depth: int = bfs_depth, workers: int = spider_workers):
+        self.seeds = seeds
+        self.target_depth = target_depth
+        self.workers = workers
+        self._ctx: SpawnContext = multiprocessing.get_context('spawn')
+
+    def run(self) -> None:
+        ring = HashRing(self.workers)
+        inboxes = [self._ctx.Queue() for _ in range(self.workers)]
+        idle = self._ctx.Array('b', self.workers)
+        sent = self._ctx.Value('q', 0)
+        received = self._ctx.Value('q', 0)
+        stop = self._ctx.Event()
+
+        processes = []
+        for shard in range(self.workers):
+            seeds = [seed for seed in self.seeds if ring.owner(seed) == shard]
+            process = self._ctx.Process(
+                target=_run_shard,
+                args=(shard, self.workers, seeds, self.target_depth, inboxes, idle, sent, received, stop),
+                name=f'spider-{shard}'
+            )
+            process.start()
+            processes.append(process)
+        logger.info(f'已启动{self.workers}个爬虫进程')
+
+        try:
+            last = None
+            while any(process.is_alive() for process in processes):
+                time.sleep(1)
+                counts = (sent.value, received.value)
+                if all(idle[:]) and counts[0] == counts[1]:
+                    if counts == last:
+                        logger.info('所有分片均已空闲，抓取结束')
+                        break
+                    last = counts
+                else:
+                    last = None
+        except KeyboardInterrupt:
+            logger.warning('收到中断信号，正在通知爬虫进程保存状态并退出')
+        finally:
+            stop.set()
+            for process in processes:
+                process.join()
+
+
+if __name__ == '__main__':
+    SpiderLog()
+    Coordinator(spider_seeds).run()
@@ -0,0 +1,252 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable
+
+import aiohttp
+from loguru import logger
+
+from config import (
+    engine_name_en,
+    spider_concurrency,
+    spider_host_concurrency,
+    spider_host_delay,
+)
+from fetcher import fetch_document_async, new_async_session
+from mongodb import BulkWriter
+from robots import RobotsParser
+from spider import (
+    page_head,
+    head_text,
+    resolve_canonical,
+    build_page_data,
+    check_near_duplicate,
+    expand_links,
+    propagate_weight,
+    new_visited_filter,
+    new_governor,
+    open_frontier,
+)
+from page_parser import extract_links
+from simhash import SimHashIndex
+from storage import get_storage
+from utils import AsyncLangBatcher, ParserLink, get_lang_detector
+
+
+_evict_size = 1024  # HostLimiter记录的域名数达到该值时才检查一次空闲的域名
+
+
+class HostLimiter:
+    """
+    按域名限制并发数与请求间隔，替代全局的sleep
+    用于没有爬虫队列的增量重抓；异步爬虫由队列（Frontier）按域名控制出队的间隔和并发数
+    """
+
+    def __init__(self, concurrency: int = spider_host_concurrency, delay: float = spider_host_delay):
+        self._concurrency = concurrency
+        self._delay = delay
+        self._semaphores: dict[str, asyncio.Semaphore] = {}
+        self._next_time: dict[str, float] = {}
+        self._users: dict[str, int] = {}  # 域名 -> 正在请求或等待的数量
+        self._evict_at = _evict_size
+
+    @asynccontextmanager
+    async def slot(self, host: str, delay: float | None = None) -> AsyncIterator[None]:
+        """
+        :param delay: robots.txt中的Crawl-delay，大于默认间隔时使用
+        """
+        self._users[host] = self._users.get(host, 0) + 1
+        semaphore = self._semaphores.setdefault(host, asyncio.Semaphore(self._concurrency))
+        try:
+            async with semaphore:
+                # 先占用下一次可请求的时间点再等待，保证同一域名的请求之间至少间隔delay
+                now = asyncio.get_running_loop().time()
+                start = max(now, self._next_time.get(host, 0.0))
+                self._next_time[host] = start + max(self._delay, delay or 0.0)
+                if start > now:
+                    await asyncio.sleep(start - now)
+                yield
+        finally:
+            users = self._users.pop(host) - 1
+            if users:
+                self._users[host] = users
+            self._evict()
+
+    def _evict(self) -> None:
+        """
+        删除没有请求、且已过间隔时间的域名，记录的域名数翻倍时才检查一次，均摊到每次请求为O(1)
+        """
+        if len(self._next_time) < self._evict_at:
+            return
+        now = asyncio.get_running_loop().time()
+        for host in [host for host, next_time in self._next_time.items() if next_time <= now]:
+            if host not in self._users:
+                del self._next_time[host]
+                del self._semaphores[host]
+        self._evict_at = max(2 * len(self._next_time), _evict_size)
+
+
+class AsyncCrawler:
+    """
+    异步爬虫
+    多个worker协程同时从队列中取链接抓取，吞吐量随spider_concurrency增长
+    """
+
+    def __init__(self, start: str, file_name: str, target_depth: int = 2,
+                 concurrency: int = spider_concurrency, seeds: list[str] | None = None):
+        """
+        :param start: 根站
+        :param seeds: 初始入队的链接，默认为[start]
+        """
+        self.start = start
+        self.file_name = file_name
+        self.target_depth = target_depth
+        self.concurrency = concurrency
+
+        # 队列的SQLite连接只能在创建它的线程中使用，布隆过滤器也不是线程安全的，
+        # 二者都在同一个队列线程中创建和操作，不阻塞事件循环
+        self._queue_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='frontier')
+        self.visited = new_visited_filter(file_name)
+        self.queue = self._queue_executor.submit(
+            open_frontier, file_name, self.visited, seeds if seeds is not None else [start]
+        ).result()
+        self.robots_parser = RobotsParser(user_agent=engine_name_en)
+        self.simhashes = SimHashIndex()
+        self.governor = new_governor(concurrency)
+        self.lang = AsyncLangBatcher(get_lang_detector())  # 启动时加载语言检测模型
+
+        self._session: aiohttp.ClientSession | None = None
+        self._writer: BulkWriter | None = None
+        self._in_flight = 0
+        self._wakeup = asyncio.Event()
+
+    async def run(self) -> None:
+        async with new_async_session(self.concurrency) as session:
+            self._session = session
+            with get_storage().writer() as writer:
+                self._writer = writer
+                self.governor.start()
+                workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+                try:
+                    await asyncio.gather(*workers)
+                finally:
+                    for worker in workers:
+                        worker.cancel()
+                    self.governor.stop()
+                    await self._queue_call(self._close_queue)
+                    self._queue_executor.shutdown()
+                    self.simhashes.close()
+
+    def _close_queue(self) -> None:
+        self.queue.close()
+        self.visited.flush()
+
+    async def _queue_call(self, func: Callable[..., Any], *args: Any) -> Any:
+        """
+        在队列线程中执行func，所有对队列和布隆过滤器的操作都经过这里串行执行
+        """
+        return await asyncio.get_running_loop().run_in_executor(self._queue_executor, func, *args)
+
+    async def _worker(self) -> None:
+        while True:
+            if self._in_flight >= self.governor.limit:  # 资源紧张时减少同时进行的抓取
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            item = await self._queue_call(self.queue.pop)
+            if item is None:
+                wait = await self._queue_call(self.queue.wait_time)
+                if wait is not None:  # 有链接但所在域名都还在间隔时间内，等到最早的域名可抓取或有新链接入队
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), wait)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                if self._in_flight == 0 and self._idle():
+                    # 队列为空且没有正在处理的链接，抓取结束，唤醒其他worker退出
+                    self._wakeup.set()
+                    return
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            url, depth, parent_weight = item
+            self._in_flight += 1
+            try:
+                await self._crawl(url, depth, parent_weight)
+            except Exception as e:
+                logger.error(f'处理 {url} 出错：{e}')
+            finally:
+                await self._queue_call(self.queue.done, url)
+                self._in_flight -= 1
+                self._wakeup.set()
+
+    def _idle(self) -> bool:
+        """
+        队列为空且没有正在处理的链接时调用，返回True表示抓取结束
+        """
+        return True
+
+    def _push(self, items: list[tuple[str, int, float | None]]) -> None:
+        """
+        在队列线程中执行
+        """
+        self.queue.push_many(items)
+
+    async def fetch(self, url: str) -> tuple[str, str] | None:
+        """
+        :return: (重定向后实际访问的链接, 页面文本)
+        """
+        if not url.startswith('http'):
+            return None
+        try:
+            return await fetch_document_async(self._session, url)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            logger.error(f'访问 {url} 出错：{e}')
+            return None
+
+    async def _crawl(self, url: str, depth: int, parent_weight: float | None) -> None:
+        if depth > self.target_depth + 1:  # 目标深度的下一层只保存信息，再往下则不抓取
+            return
+        if not await asyncio.to_thread(self.robots_parser.can_crawl, url):
+            logger.warning(f'{url}不允许爬')
+            return
+        # 同一域名的出队间隔由队列控制，Crawl-delay大于spider_host_delay时从下一次出队开始生效
+        delay = await asyncio.to_thread(self.robots_parser.crawl_delay, url)
+        await self._queue_call(self.queue.set_delay, ParserLink(url).netloc, delay)
+        logger.info(f"深度：{depth}，链接：{url}，process：{multiprocessing.current_process().name}")
+
+        page = await self.fetch(url)
+        if page is None:
+            return
+        base, text = page
+        head = await asyncio.to_thread(page_head, url, text)
+        if head is None:
+            return
+        href = resolve_canonical(url, head, base)
+        if href != url and not (await self._queue_call(self.visited.add_many, [href]))[0]:
+            logger.info(f'{url} 的规范链接 {href} 已抓取过')
+            return
+        fingerprint, duplicate = await asyncio.to_thread(check_near_duplicate, self.simhashes, href, head, text)
+        if duplicate is not None:  # 镜像、模板页等近似重复的页面不保存，也不再抓取其子链接
+            logger.info(f'{href} 与 {duplicate} 近似重复')
+            return
+        lang, like = await self.lang.predict(head_text(head), ParserLink(url).netloc)
+        this_data = build_page_data(href, head, lang, like)
+        this_data[0]['simhash'] = fingerprint
+        weight = this_data[0]['weight'] if this_data[0]['weight'] >= 0.5 else 1 - this_data[0]['weight']  # 确保加权
+
+        if parent_weight is not None:
+            await asyncio.to_thread(self._writer.add, propagate_weight(this_data, parent_weight))
+        if depth <= self.target_depth:
+            links = await asyncio.to_thread(extract_links, text)
+            await self._queue_call(self._push, expand_links(base, links, depth, weight))
+            self._wakeup.set()
+
+
+async def async_bfs(start: str, file_name: str, target_depth: int = 2,
+                    concurrency: int = spider_concurrency) -> None:
+    await AsyncCrawler(start, file_name, target_depth, concurrency).run()
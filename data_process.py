@@ -1,69 +1,270 @@
-from collections import defaultdict
-from time import sleep
-from typing import Any, Union
+import multiprocessing
+import os
+import time
+from collections import defaultdict, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any
 
-import requests
-from bs4 import BeautifulSoup
+import jieba
 from jieba import lcut_for_search
 from loguru import logger
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+import numpy as np
 
-from config import stop_words, db_name, key_col_name, engine_name_en
-from database import MongoDB
-from mongodb import save_data
+from config import (
+    stop_words,
+    index_batch_size,
+    index_flush_size,
+    index_lag,
+    index_workers,
+    bm25_k1,
+    bm25_b,
+    bm25_boosts,
+)
+from fetcher import fetch_html
+from page_parser import extract_links
+from postings import PostingList, encode_postings, intersect_postings, union_postings
+from storage import Storage, get_storage
 from utils import cost_time, is_url
 
+_index_fields = ('title', 'keywords', 'description')
+_stop_words = frozenset(stop_words)
+postings_format = 'varint-skip-tf-2'  # 倒排记录格式，与数据库中保存的不同时重建索引
+
+# (文档编号, 页面, 上次索引时该页面的记录)
+AnalyzeItem = tuple[int, dict[str, Any], dict[str, Any] | None]
+# (新增或词频变化的关键词 {关键词: [(文档编号, 各字段词频)]}, 消失的关键词 {关键词: [文档编号]},
+#  变化过的页面的记录, 第一次索引的页面数, 各字段总长度的变化)
+AnalyzeResult = tuple[dict[str, list[tuple[int, tuple[int, ...]]]], dict[str, list[int]], dict[int, dict[str, Any]],
+                      int, list[int]]
+
+
+def _init_analyzer() -> None:
+    """
+    分词进程启动时加载一次jieba词典
+    """
+    jieba.initialize()
+
+
+def analyze(items: list[AnalyzeItem]) -> AnalyzeResult:
+    """
+    对一批页面分词，并与上次索引时的记录比较，得到这批页面的部分倒排记录，在分词进程中执行
+    页面的记录为{'terms': [[关键词, 各字段词频...]], 'lengths': [各字段长度]}，字段长度为该字段去除停用词后的词数
+    """
+    adds: defaultdict[str, list[tuple[int, tuple[int, ...]]]] = defaultdict(list)
+    removes: defaultdict[str, list[int]] = defaultdict(list)
+    records = {}
+    new_docs = 0
+    lengths_delta = [0] * len(_index_fields)
+    for doc_id, data, old_record in items:
+        freqs = ReverseIndex.term_freqs(data)
+        old = {} if old_record is None else {row[0]: tuple(row[1:]) for row in old_record['terms']}
+        if old_record is not None and freqs == old:
+            continue
+        for term, tf in freqs.items():
+            if old.get(term) != tf:
+                adds[term].append((doc_id, tf))
+        for term in old.keys() - freqs.keys():
+            removes[term].append(doc_id)
+        lengths = [sum(tf[i] for tf in freqs.values()) for i in range(len(_index_fields))]
+        old_lengths = [0] * len(_index_fields) if old_record is None else old_record['lengths']
+        lengths_delta = [delta + new - old for delta, new, old in zip(lengths_delta, lengths, old_lengths)]
+        new_docs += old_record is None
+        records[doc_id] = {'terms': [[term, *tf] for term, tf in sorted(freqs.items())], 'lengths': lengths}
+    return dict(adds), dict(removes), records, new_docs, lengths_delta
+
+
+class _InlineExecutor:
+    """
+    只有一个分词进程时在当前进程中分词，接口与ProcessPoolExecutor相同
+    """
+
+    def submit(self, fn, *args) -> Future:
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+    def __enter__(self) -> '_InlineExecutor':
+        return self
+
+    def __exit__(self, exc_type: Any, exc_val: Any, exc_tb: Any) -> None:
+        pass
+
 
 class ReverseIndex:
     """
-    反向索引构建器
+    增量反向索引构建器
+    页面第一次被索引时分配文档编号（doc_id），之后不再改变，去重和新增页面不会使已有的倒排记录失效。
+    每次只处理上次运行以来写入或更新过的页面，与上次索引时该页面的关键词比较，只把新增和消失的关键词
+    合并进对应的倒排记录；每个关键词只有一条记录，变更在内存中累计到flush_size条后批量写入。
+    分词在workers个进程中进行，每批页面的部分倒排记录在主进程中合并。
     """
 
-    def __init__(self):
-        # {'key': [index]}
-        self.index = defaultdict()
+    def __init__(self, storage: Storage | None = None, batch_size: int = index_batch_size,
+                 flush_size: int = index_flush_size, workers: int = index_workers):
+        """
+        :param workers: 分词进程数，0为CPU核数，1为在当前进程中分词
+        """
+        self.storage = storage if storage is not None else get_storage()
+        self.batch_size = batch_size
+        self.flush_size = flush_size
+        self.workers = workers or os.cpu_count() or 1
+        self._adds: defaultdict[str, dict[int, tuple[int, ...]]] = defaultdict(dict)
+        self._removes: defaultdict[str, set[int]] = defaultdict(set)
+        self._records: dict[int, dict[str, Any]] = {}  # 倒排记录写入后再保存，中途出错时下次还能重新合并
+        self._stats: dict[str, Any] = {}
+        self._pending = 0
 
-    @cost_time
-    def build_index(self, doc: list[dict[str, Any]], rank: int) -> bool:
-        if len(doc) < 20:
-            return False
-        words = []
-        for doc_id, data in enumerate(doc):
-            try:
-                words.extend(remove_stop_words(lcut_for_search(data['title'])))
-                words.extend(remove_stop_words(lcut_for_search(data['keywords'])))
-                words.extend(remove_stop_words(lcut_for_search(data['description'])))
-            except Exception:
+    @staticmethod
+    def term_freqs(data: dict[str, Any]) -> dict[str, tuple[int, ...]]:
+        """
+        :return: {关键词: 在title、keywords和description中出现的次数}，分词后去除停用词
+        """
+        counts: dict[str, list[int]] = {}
+        for i, field in enumerate(_index_fields):
+            if not data.get(field):
                 continue
-            for word in words:
-                if word not in self.index:
-                    self.index[word] = []
-                self.index[word].append(20 * rank + doc_id)
-        return True
+            for word in lcut_for_search(str(data[field])):
+                if word.strip() and word not in _stop_words:
+                    counts.setdefault(word, [0] * len(_index_fields))[i] += 1
+        return {term: tuple(tf) for term, tf in counts.items()}
 
-    @cost_time
-    def save_index(self) -> None:
-        with MongoDB(db_name, key_col_name) as db:
-            for key, value in self.index.items():
-                save_data(
-                    [{'key': key, 'value': value}],
-                    db.col
-                )
-        sleep(2)
+    @staticmethod
+    def tokenize(data: dict[str, Any]) -> set[str]:
+        """
+        :return: 页面title、keywords和description分词并去除停用词后的关键词
+        """
+        return set(ReverseIndex.term_freqs(data))
 
     @cost_time
-    def search(self, query: str) -> list:
-        query_words = lcut_for_search(query)
-        query_words = remove_stop_words(query_words)
-        result = set()
-        for word in query_words:
-            if word in self.index:
-                result.update(self.index[word])  # 合并集合
-        return list(result)
+    def build_index(self) -> int:
+        """
+        第一次运行时索引全部页面，之后只索引上次开始运行（提前index_lag秒）以来变化过的页面
+        :return: 本次处理的页面数
+        """
+        start = time.time()
+        indexed_at = self.storage.get_meta('indexed_at')
+        if indexed_at is None or self.storage.get_meta('postings_format') != postings_format:
+            self.storage.clear_index()
+            self.storage.set_meta('postings_format', postings_format)
+            self.storage.set_meta('stats', new_stats())
+            pages = self.storage.find_pages(['href', 'doc_id', *_index_fields])
+        else:
+            pages = self.storage.find_changed_pages(indexed_at - index_lag, ['href', 'doc_id', *_index_fields])
+        self._stats = self.storage.get_meta('stats') or new_stats()
+        self.storage.create_indexes()
+
+        next_doc_id = self.storage.get_meta('next_doc_id', 0)
+        count = 0
+        with self._pool() as pool:
+            futures: deque[Future] = deque()
+            batch = []
+            for data in pages:
+                batch.append(data)
+                if len(batch) >= self.batch_size:
+                    next_doc_id = self._submit(pool, futures, batch, next_doc_id)
+                    count += len(batch)
+                    batch = []
+            if batch:
+                next_doc_id = self._submit(pool, futures, batch, next_doc_id)
+                count += len(batch)
+            while futures:
+                self._merge(futures.popleft().result())
+        self._flush()
+        self.storage.set_meta('indexed_at', start)
+        logger.info(f'索引了{count}个页面，共分配{next_doc_id}个文档编号')
+        return count
+
+    def _pool(self) -> ProcessPoolExecutor | _InlineExecutor:
+        if self.workers == 1:
+            return _InlineExecutor()
+        return ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=_init_analyzer)
+
+    def _submit(self, pool: ProcessPoolExecutor | _InlineExecutor, futures: deque[Future],
+                batch: list[dict[str, Any]], next_doc_id: int) -> int:
+        """
+        分配文档编号后交给分词进程，同时最多有2 * workers批在处理，先提交的先合并
+        :return: 下一个可分配的文档编号
+        """
+        new_ids = {}
+        for data in batch:
+            if data.get('doc_id') is None:
+                data['doc_id'] = new_ids[data['href']] = next_doc_id
+                next_doc_id += 1
+        if new_ids:
+            self.storage.set_meta('next_doc_id', next_doc_id)  # 先保存，中途出错也不会重复分配
+            self.storage.set_doc_ids(new_ids)
 
-    def get_index(self) -> defaultdict:
-        return self.index
+        old_records = self.storage.get_doc_terms([data['doc_id'] for data in batch])
+        items = [(data['doc_id'], {field: data.get(field) for field in _index_fields}, old_records.get(data['doc_id']))
+                 for data in batch]
+        futures.append(pool.submit(analyze, items))
+        while len(futures) > 2 * self.workers or (futures and futures[0].done()):
+            self._merge(futures.popleft().result())
+        return next_doc_id
+
+    def _merge(self, result: AnalyzeResult) -> None:
+        """
+        合并一批页面的部分倒排记录，每个页面在一次运行中只出现一次，不同批之间不会冲突
+        """
+        adds, removes, records, new_docs, lengths_delta = result
+        for term, postings in adds.items():
+            self._adds[term].update(postings)
+            self._pending += len(postings)
+        for term, doc_ids in removes.items():
+            self._removes[term].update(doc_ids)
+            self._pending += len(doc_ids)
+        self._records.update(records)
+        self._stats['doc_count'] += new_docs
+        self._stats['lengths'] = [total + delta for total, delta in zip(self._stats['lengths'], lengths_delta)]
+        if self._pending >= self.flush_size:
+            self._flush()
+
+    def _flush(self) -> None:
+        """
+        读出受影响关键词的倒排记录，解码并合并变更后重新压缩，整条写回，之后保存页面记录和全局统计
+        """
+        terms = list(self._adds.keys() | self._removes.keys())
+        if terms:
+            postings = self.storage.get_postings(terms)
+            merged = {}
+            for term in terms:
+                adds = self._adds.get(term, {})
+                if term in postings:
+                    posting_list = PostingList(postings[term])
+                    doc_ids, freqs = posting_list.decode(), posting_list.freqs()
+                    drop = self._removes.get(term, set()) | adds.keys()
+                    keep = ~np.isin(doc_ids, np.fromiter(drop, dtype=np.int64, count=len(drop)))
+                    doc_ids, freqs = doc_ids[keep], freqs[keep]
+                else:
+                    doc_ids, freqs = np.empty(0, dtype=np.int64), np.empty((0, len(_index_fields)), dtype=np.uint8)
+                if adds:
+                    doc_ids = np.concatenate((doc_ids, np.fromiter(adds.keys(), dtype=np.int64, count=len(adds))))
+                    freqs = np.concatenate((freqs, np.minimum(np.array(list(adds.values())), 255).astype(np.uint8)))
+                    order = np.argsort(doc_ids, kind='stable')
+                    doc_ids, freqs = doc_ids[order], freqs[order]
+                merged[term] = encode_postings(doc_ids, freqs) if len(doc_ids) else b''
+            self.storage.save_postings(merged)
+            logger.info(f'更新了{len(merged)}个关键词的倒排记录')
+        if self._records:
+            self.storage.save_doc_terms(self._records)
+            self.storage.set_meta('stats', self._stats)
+        self._adds.clear()
+        self._removes.clear()
+        self._records = {}
+        self._pending = 0
+
+    def search(self, query: str, match_all: bool = False) -> list[int]:
+        """
+        :param match_all: 为True时返回包含全部查询关键词的文档编号，否则返回包含任一关键词的
+        """
+        words = {word for word in remove_stop_words(lcut_for_search(query)) if word.strip()}
+        datas = [self.storage.search_key(word) for word in words]
+        if match_all:
+            if not datas or None in datas:
+                return []
+            return intersect_postings(*datas).tolist()
+        return union_postings(*[data for data in datas if data is not None]).tolist()
 
 
 class BackLink:
@@ -76,16 +277,10 @@ class BackLink:
 
     @staticmethod
     def requests(link: str) -> list | None:
-        try:
-            res = requests.get(link, headers={'user-agent': engine_name_en}, timeout=4)
-            res.encoding = 'utf-8'
-            if res.status_code == 200:
-                soup = BeautifulSoup(res.text, 'html.parser')
-                hrefs = [a['href'] for a in soup.find_all('a', href=True) if is_url(a['href'])]
-                return hrefs
-        except requests.exceptions.RequestException as e:
-            logger.warning(f'获取反链时{e}')
+        text = fetch_html(link)
+        if text is None:
             return None
+        return [href for href in extract_links(text) if is_url(href)]
 
     def add(self, source: str, target: str) -> None:
         """
@@ -103,22 +298,61 @@ class BackLink:
         logger.warning(f'无此键：{key}')
 
 
-def TFIDF(texts: list[str], querys: list[str]) -> Union[list[int], None]:
-    vectorizer = TfidfVectorizer()
-    tfidf_matrix = vectorizer.fit_transform(texts)
+def new_stats() -> dict[str, Any]:
+    """
+    :return: 空索引的全局统计：已索引的页面数和各字段的总长度
+    """
+    return {'doc_count': 0, 'lengths': [0] * len(_index_fields)}
 
-    # 计算每个查询与文档的相似性分数
-    query_similarity_scores = []
-    for query in querys:
-        user_query_vector = vectorizer.transform([query])
-        similarity_scores = cosine_similarity(user_query_vector, tfidf_matrix)
-        query_similarity_scores.append(similarity_scores)
 
-    combined_scores = sum(query_similarity_scores) / len(querys)  # 综合所有查询的分数，计算平均分数
-    ranked_indices = combined_scores.argsort()[0][::-1]  # 从高到低排列
-    return ranked_indices.tolist()
+class BM25:
+    """
+    BM25F打分
+    每个字段的词频先按该页面字段长度与平均长度之比归一化，再按bm25_boosts加权求和，最后按BM25的方式饱和：
+    score = Σ idf * tf * (k1 + 1) / (tf + k1)，tf = Σ boost * 字段词频 / (1 - b + b * 字段长度 / 字段平均长度)，
+    idf = ln(1 + (N - df + 0.5) / (df + 0.5))。
+    页面数、字段平均长度和文档频率都来自整个索引，同一页面在不同查询中的分数一致。
+    """
+
+    def __init__(self, stats: dict[str, Any] | None, k1: float = bm25_k1, b: float = bm25_b,
+                 boosts: dict[str, float] = bm25_boosts):
+        """
+        :param stats: 全局统计，格式同new_stats()
+        """
+        stats = stats or new_stats()
+        self.doc_count = stats['doc_count']
+        self.avg_lengths = np.maximum(np.asarray(stats['lengths'], dtype=np.float64) / max(self.doc_count, 1), 1e-6)
+        self.k1 = k1
+        self.b = b
+        self.boosts = np.array([boosts[field] for field in _index_fields], dtype=np.float64)
+
+    def score(self, postings: list[bytes], doc_ids, lengths) -> np.ndarray:
+        """
+        :param postings: 各查询关键词的倒排记录
+        :param doc_ids: 需要打分的文档编号，没有编号的页面为-1
+        :param lengths: 与doc_ids对应的各字段长度
+        :return: 与doc_ids对应的分数
+        """
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        scores = np.zeros(len(doc_ids))
+        if len(doc_ids) == 0:
+            return scores
+        order = np.argsort(doc_ids, kind='stable')
+        sorted_ids = doc_ids[order]
+        norms = 1 - self.b + self.b * np.asarray(lengths, dtype=np.float64).reshape(len(doc_ids), -1) / self.avg_lengths
+        for data in postings:
+            posting_list = PostingList(data)
+            ids = posting_list.decode()
+            positions = np.searchsorted(sorted_ids, ids)
+            hit = positions < len(sorted_ids)
+            hit[hit] = sorted_ids[positions[hit]] == ids[hit]
+            rows = order[positions[hit]]
+            tf = (posting_list.freqs()[hit] * self.boosts / norms[rows]).sum(axis=1)
+            df = len(posting_list)
+            idf = np.log(1 + (max(self.doc_count, df) - df + 0.5) / (df + 0.5))
+            scores[rows] += idf * tf * (self.k1 + 1) / (tf + self.k1)
+        return scores
 
 
 def remove_stop_words(ori_list: list[Any]) -> list[str]:
-    words = set(stop_words)
-    return [item for item in ori_list if item not in words]
+    return [item for item in ori_list if item not in _stop_words]
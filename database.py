@@ -1,34 +1,108 @@
+import atexit
+import os
+import threading
 from typing import Any
 
 from loguru import logger
 from pymongo import MongoClient
 from pymongo.collection import Collection
 
-from config import mongodb_host, mongodb_port
+from config import mongodb_host, mongodb_port, mongodb_pool_size
+
+_client: MongoClient | None = None
+_client_pid: int | None = None
+_async_client: Any = None
+_async_client_pid: int | None = None
+_lock = threading.Lock()
+
+
+def get_client() -> MongoClient:
+    """
+    进程内共用的MongoClient，连接池由pymongo管理，第一次使用时才创建
+    fork出的子进程不能沿用父进程的连接和监控线程，检测到进程号变化时重新创建
+    """
+    global _client, _client_pid
+    if _client is not None and _client_pid == os.getpid():
+        return _client
+    with _lock:
+        if _client is None or _client_pid != os.getpid():
+            _client = MongoClient(host=mongodb_host, port=mongodb_port, maxPoolSize=mongodb_pool_size, connect=False)
+            _client_pid = os.getpid()
+    return _client
+
+
+def get_async_client() -> Any:
+    """
+    get_client()的异步版本（motor），供FastAPI服务使用，需在事件循环中第一次调用
+    """
+    global _async_client, _async_client_pid
+    if _async_client is not None and _async_client_pid == os.getpid():
+        return _async_client
+    try:
+        from motor.motor_asyncio import AsyncIOMotorClient
+    except ImportError:
+        raise ImportError('Requires motor')
+    with _lock:
+        if _async_client is None or _async_client_pid != os.getpid():
+            _async_client = AsyncIOMotorClient(host=mongodb_host, port=mongodb_port, maxPoolSize=mongodb_pool_size)
+            _async_client_pid = os.getpid()
+    return _async_client
+
+
+def close_clients() -> None:
+    global _client, _async_client
+    with _lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        if _async_client is not None and _async_client_pid == os.getpid():
+            _async_client.close()
+        _client = _async_client = None
+
+
+atexit.register(close_clients)
 
 
 class MongoDB:
+    """
+    从进程内共用的客户端取得集合，退出时不关闭客户端，连接留在连接池中复用
+    """
+
     def __init__(self, db_name: str, col_name: str):
         self.client: MongoClient | None = None
         self.db = None
         self.col: Collection | None = None
-        self.closed = False
         self.db_name = db_name
         self.col_name = col_name
 
     def __enter__(self) -> 'MongoDB':
-        self.client = MongoClient(host=mongodb_host, port=mongodb_port)
+        self.client = get_client()
         self.db = self.client[self.db_name]
         self.col = self.db[self.col_name]
         return self
 
     def __exit__(self, exc_type: Any, exc_val: Any, exc_tb: Any) -> None:
-        try:
-            if not self.closed:
-                if exc_type is not None:
-                    logger.error(f'出现错误：{exc_type}-{exc_val}-{exc_tb}')
-                self.client.close()
-                self.closed = True
-        finally:
-            if self.client:
-                self.client.close()
+        if exc_type is not None:
+            logger.error(f'出现错误：{exc_type}-{exc_val}-{exc_tb}')
+
+
+class AsyncMongoDB:
+    """
+    MongoDB的异步版本，用法为 async with AsyncMongoDB(db_name, col_name) as db
+    """
+
+    def __init__(self, db_name: str, col_name: str):
+        self.client = None
+        self.db = None
+        self.col = None
+        self.db_name = db_name
+        self.col_name = col_name
+
+    async def __aenter__(self) -> 'AsyncMongoDB':
+        self.client = get_async_client()
+        self.db = self.client[self.db_name]
+        self.col = self.db[self.col_name]
+        return self
+
+    async def __aexit__(self, exc_type: Any, exc_val: Any, exc_tb: Any) -> None:
+        if exc_type is not None:
+            logger.error(f'出现错误：{exc_type}-{exc_val}-{exc_tb}')
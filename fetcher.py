@@ -0,0 +1,382 @@
+import asyncio
+import codecs
+import os
+import re
+import socket
+import threading
+import time
+from collections import OrderedDict
+
+import aiohttp
+import requests
+from loguru import logger
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+from urllib3.util.retry import Retry
+
+from config import (
+    engine_name_en,
+    fetch_max_bytes,
+    fetch_accept,
+    fetch_html_types,
+    fetch_timeout,
+    fetch_retries,
+    fetch_backoff,
+    fetch_pool_hosts,
+    fetch_pool_size,
+    fetch_dns_ttl,
+    fetch_dns_cache_size,
+    spider_concurrency,
+    spider_host_concurrency,
+)
+
+try:
+    import brotli  # noqa: F401  安装后requests和aiohttp都能解码br压缩的响应
+    _accept_encoding = 'gzip, deflate, br'
+except ImportError:
+    _accept_encoding = 'gzip, deflate'
+
+_headers = {
+    'User-Agent': engine_name_en,
+    'Accept': fetch_accept,
+    'Accept-Encoding': _accept_encoding,
+}
+_retry_statuses = (429, 500, 502, 503, 504)
+_chunk_size = 16384
+_sniff_size = 4096
+
+_charset_pattern = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?\s*([a-zA-Z0-9_\-:.]+)', re.IGNORECASE)
+_boms = (
+    (codecs.BOM_UTF8, 'utf-8'),
+    (codecs.BOM_UTF16_LE, 'utf-16-le'),
+    (codecs.BOM_UTF16_BE, 'utf-16-be'),
+)
+# 国内网站常把GBK编码的页面声明为gb2312，统一按超集gb18030解码
+_charset_aliases = {
+    'gb2312': 'gb18030',
+    'gbk': 'gb18030',
+    'x-gbk': 'gb18030',
+    'big5': 'big5hkscs',
+    'iso-8859-1': 'cp1252',
+    'latin1': 'cp1252',
+    'us-ascii': 'cp1252',
+}
+
+
+def is_html(content_type: str | None) -> bool:
+    """
+    根据Content-Type判断是否为HTML页面，未声明类型时先视为HTML，读取后再用looks_like_html()判断
+    """
+    if not content_type:
+        return True
+    return content_type.split(';', 1)[0].strip().lower() in fetch_html_types
+
+
+def looks_like_html(body: bytes) -> bool:
+    return body[:_sniff_size].lstrip()[:1] == b'<'
+
+
+def _charset_from_content_type(content_type: str | None) -> str | None:
+    if not content_type:
+        return None
+    for param in content_type.split(';')[1:]:
+        name, _, value = param.partition('=')
+        if name.strip().lower() == 'charset':
+            return value.strip().strip('"\'') or None
+    return None
+
+
+def _normalize_charset(charset: str | None) -> str | None:
+    if not charset:
+        return None
+    charset = charset.strip().lower()
+    charset = _charset_aliases.get(charset, charset)
+    try:
+        return codecs.lookup(charset).name
+    except LookupError:
+        return None
+
+
+def detect_charset(content_type: str | None, body: bytes) -> str:
+    """
+    依次按BOM、Content-Type中的charset、页面开头的<meta charset>或<meta http-equiv>确定编码，都没有时为utf-8
+    """
+    for bom, charset in _boms:
+        if body.startswith(bom):
+            return charset
+    charset = _normalize_charset(_charset_from_content_type(content_type))
+    if charset:
+        return charset
+    match = _charset_pattern.search(body[:_sniff_size])
+    if match:
+        charset = _normalize_charset(match.group(1).decode('ascii', errors='ignore'))
+        if charset and not charset.startswith('utf-16'):  # 能读出ASCII的meta说明不是utf-16
+            return charset
+    return 'utf-8'
+
+
+def decode_html(body: bytes, content_type: str | None = None) -> str:
+    return body.decode(detect_charset(content_type, body), errors='ignore')
+
+
+def read_limited(response: requests.Response, max_bytes: int = fetch_max_bytes) -> bytes:
+    """
+    流式读取响应，超过max_bytes后不再读取，只保留前max_bytes字节
+    """
+    chunks = []
+    size = 0
+    for chunk in response.iter_content(_chunk_size):
+        chunks.append(chunk)
+        size += len(chunk)
+        if size >= max_bytes:
+            logger.info(f'{response.url} 超过{max_bytes}字节，只读取前{max_bytes}字节')
+            break
+    return b''.join(chunks)[:max_bytes]
+
+
+async def read_limited_async(response: aiohttp.ClientResponse, max_bytes: int = fetch_max_bytes) -> bytes:
+    """
+    read_limited()的异步版本
+    """
+    chunks = []
+    size = 0
+    async for chunk in response.content.iter_chunked(_chunk_size):
+        chunks.append(chunk)
+        size += len(chunk)
+        if size >= max_bytes:
+            logger.info(f'{response.url} 超过{max_bytes}字节，只读取前{max_bytes}字节')
+            break
+    return b''.join(chunks)[:max_bytes]
+
+
+class _RetryableStatus(Exception):
+    """
+    异步请求返回了可重试的状态码
+    """
+
+
+class DNSCache:
+    """
+    带过期时间的DNS缓存，同一域名在ttl秒内只解析一次，最多保存max_size个域名（LRU）
+    只供get_session()的连接池新建连接时使用，不替换socket.getaddrinfo，不影响数据库驱动等其他库；
+    连接池复用连接时不会解析域名，这里减少的是新建连接时的解析
+    """
+
+    def __init__(self, ttl: float = fetch_dns_ttl, max_size: int = fetch_dns_cache_size):
+        self._ttl = ttl
+        self._max_size = max_size
+        self._cache: OrderedDict[tuple[str, int], tuple[list, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def getaddrinfo(self, host: str, port: int) -> list:
+        key = (host, port)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached and cached[1] > time.monotonic():
+                self._cache.move_to_end(key)
+                return cached[0]
+        result = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+        if self._ttl > 0 and self._max_size > 0:
+            with self._lock:
+                self._cache[key] = (result, time.monotonic() + self._ttl)
+                self._cache.move_to_end(key)
+                while len(self._cache) > self._max_size:
+                    self._cache.popitem(last=False)
+        return result
+
+
+_dns_cache = DNSCache()
+
+
+class _CachedDNSConnection:
+    """
+    新建连接时从_dns_cache取得域名的地址，依次尝试各个地址
+    """
+
+    def _new_conn(self):
+        dns_host = self._dns_host
+        try:
+            addresses = _dns_cache.getaddrinfo(dns_host, self.port)
+        except socket.gaierror as e:
+            raise NewConnectionError(self, f'解析 {self.host} 出错：{e}') from e
+        error: ConnectTimeoutError = NewConnectionError(self, f'解析 {self.host} 没有得到地址')
+        try:
+            for *_, sockaddr in addresses:
+                self._dns_host = sockaddr[0]  # 连接IP地址，TLS的SNI和证书校验仍使用self.host
+                try:
+                    return super()._new_conn()
+                except ConnectTimeoutError as e:  # 包括NewConnectionError
+                    error = e
+        finally:
+            self._dns_host = dns_host
+        raise error
+
+
+class _HTTPConnection(_CachedDNSConnection, HTTPConnection):
+    pass
+
+
+class _HTTPSConnection(_CachedDNSConnection, HTTPSConnection):
+    pass
+
+
+class _HTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _HTTPConnection
+
+
+class _HTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _HTTPSConnection
+
+
+class _CachedDNSAdapter(HTTPAdapter):
+    """
+    连接池使用带DNS缓存的连接
+    """
+
+    def init_poolmanager(self, *args, **kwargs) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': _HTTPConnectionPool, 'https': _HTTPSConnectionPool}
+
+
+_session: requests.Session | None = None
+_session_pid: int | None = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """
+    进程内共用的requests.Session
+    每个域名保留fetch_pool_size个长连接，新建连接时的DNS结果缓存fetch_dns_ttl秒，
+    连接失败和429、5xx响应按fetch_retries和fetch_backoff重试。
+    fork出的子进程不会沿用父进程的连接，首次调用时重新创建。
+    """
+    global _session, _session_pid
+    if _session is not None and _session_pid == os.getpid():
+        return _session
+    with _session_lock:
+        if _session is None or _session_pid != os.getpid():
+            retry = Retry(
+                total=fetch_retries,
+                backoff_factor=fetch_backoff,
+                status_forcelist=_retry_statuses,
+                allowed_methods=('GET', 'HEAD'),
+                raise_on_status=False,
+                respect_retry_after_header=True
+            )
+            adapter = _CachedDNSAdapter(pool_connections=fetch_pool_hosts, pool_maxsize=fetch_pool_size,
+                                        max_retries=retry)
+            session = requests.Session()
+            session.headers.update(_headers)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _session, _session_pid = session, os.getpid()
+    return _session
+
+
+def fetch(url: str, stream: bool = False, timeout: float = fetch_timeout, **kwargs) -> requests.Response | None:
+    """
+    用共用的session发送GET请求，统一超时时间和重试策略
+    :return: 响应，请求出错时返回None
+    """
+    try:
+        return get_session().get(url, timeout=timeout, stream=stream, **kwargs)
+    except requests.exceptions.RequestException as e:
+        logger.error(f'访问 {url} 出错：{e}')
+        return None
+
+
+def fetch_html(url: str, max_bytes: int = fetch_max_bytes) -> str | None:
+    """
+    获取HTML页面
+    :return: 页面文本，状态码不是200、不是HTML或请求出错时返回None
+    """
+    page = fetch_document(url, max_bytes)
+    return None if page is None else page[1]
+
+
+def fetch_document(url: str, max_bytes: int = fetch_max_bytes) -> tuple[str, str] | None:
+    """
+    获取HTML页面
+    响应头声明的不是HTML时不读取正文，正文最多读取max_bytes字节，按检测到的编码解码
+    :return: (重定向后实际访问的链接, 页面文本)，页面中的相对链接应以前者为基础补全；
+             状态码不是200、不是HTML或请求出错时返回None
+    """
+    response = fetch(url, stream=True)
+    if response is None:
+        return None
+    try:
+        with response:
+            if response.status_code != 200:
+                return None
+            content_type = response.headers.get('Content-Type')
+            if not is_html(content_type):
+                logger.info(f'{url} 不是HTML页面：{content_type}')
+                return None
+            body = read_limited(response, max_bytes)
+    except requests.exceptions.RequestException as e:
+        logger.error(f'访问 {url} 出错：{e}')
+        return None
+    if not looks_like_html(body):
+        return None
+    return response.url, decode_html(body, content_type)
+
+
+def new_async_session(concurrency: int = spider_concurrency, **kwargs) -> aiohttp.ClientSession:
+    """
+    异步爬虫使用的ClientSession，连接复用、每个域名的连接数和DNS缓存由TCPConnector管理
+    """
+    connector = aiohttp.TCPConnector(
+        limit=concurrency,
+        limit_per_host=spider_host_concurrency,
+        ttl_dns_cache=fetch_dns_ttl,
+    )
+    return aiohttp.ClientSession(
+        connector=connector,
+        headers=_headers,
+        timeout=aiohttp.ClientTimeout(total=fetch_timeout),
+        **kwargs
+    )
+
+
+async def fetch_html_async(session: aiohttp.ClientSession, url: str,
+                           max_bytes: int = fetch_max_bytes) -> str | None:
+    """
+    fetch_html()的异步版本，使用调用方的session，重试策略与get_session()相同
+    """
+    page = await fetch_document_async(session, url, max_bytes)
+    return None if page is None else page[1]
+
+
+async def fetch_document_async(session: aiohttp.ClientSession, url: str,
+                               max_bytes: int = fetch_max_bytes) -> tuple[str, str] | None:
+    """
+    fetch_document()的异步版本
+    """
+    for attempt in range(fetch_retries + 1):
+        delay = fetch_backoff * 2 ** attempt
+        try:
+            async with session.get(url) as response:
+                if response.status in _retry_statuses and attempt < fetch_retries:
+                    retry_after = response.headers.get('Retry-After', '')
+                    if retry_after.isdigit():
+                        delay = max(delay, int(retry_after))
+                    raise _RetryableStatus(response.status)
+                if response.status != 200:
+                    return None
+                content_type = response.headers.get('Content-Type')
+                if not is_html(content_type):
+                    logger.info(f'{url} 不是HTML页面：{content_type}')
+                    return None
+                body = await read_limited_async(response, max_bytes)
+                final_url = str(response.url)
+        except (_RetryableStatus, aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            if attempt == fetch_retries:
+                raise
+            await asyncio.sleep(delay)
+            continue
+        if not looks_like_html(body):
+            return None
+        return final_url, decode_html(body, content_type)
+    return None
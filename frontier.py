@@ -0,0 +1,291 @@
+import heapq
+import math
+import os
+import sqlite3
+import time
+from typing import Any
+
+from loguru import logger
+
+from config import (
+    frontier_hot_size,
+    frontier_compact_interval,
+    frontier_depth_decay,
+    spider_host_concurrency,
+    spider_host_delay,
+)
+from utils import ParserLink
+
+# (链接, 深度, 父链接权重)
+Item = tuple[str, int, float | None]
+
+
+class Frontier:
+    """
+    优先级爬虫队列
+    每个链接入队时按父链接权重、深度和所在域名已入队的链接数计算分数，分数越高越先抓取。
+    内存中只保留hot_size个分数最高的链接，按域名分成若干个子队列（堆），另有一个按可抓取时间排序的堆，
+    同一域名两次出队至少间隔host_delay秒（robots.txt的Crawl-delay更大时按Crawl-delay），
+    且同时处理中的链接不超过host_concurrency个，等待某个域名时其他域名的链接照常出队。
+    全部链接保存在./temp/{file_name}.db（SQLite），处理完的链接定期删除，重启后未处理完的链接重新入队。
+    入队时用布隆过滤器去重，已入队过的链接不会再次入队。
+    """
+
+    def __init__(self, file_name: str, visited: Any, hot_size: int = frontier_hot_size,
+                 compact_interval: int = frontier_compact_interval, host_delay: float = spider_host_delay,
+                 host_concurrency: int = spider_host_concurrency, depth_decay: float = frontier_depth_decay):
+        """
+        :param file_name: ./temp下的数据库文件名（不含后缀）
+        :param visited: 布隆过滤器，需要支持add_many()
+        :param hot_size: 内存中保留的链接数
+        :param compact_interval: 每处理完多少个链接删除一次已处理完的链接
+        :param host_delay: 同一域名两次出队的最小间隔（秒）
+        :param host_concurrency: 同一域名已出队但还未处理完的链接数上限
+        :param depth_decay: 每深一层分数乘以该值
+        """
+        os.makedirs('./temp', exist_ok=True)
+        self._visited = visited
+        self._hot_size = hot_size
+        self._compact_interval = compact_interval
+        self._host_delay = host_delay
+        self._host_concurrency = host_concurrency
+        self._depth_decay = depth_decay
+
+        self._conn = sqlite3.connect(f'./temp/{file_name}.db')
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS queue ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, url TEXT NOT NULL, depth INTEGER NOT NULL, weight REAL, '
+            "host TEXT NOT NULL DEFAULT '', score REAL NOT NULL DEFAULT 0, loaded INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+        self._migrate()
+        self._conn.execute('CREATE INDEX IF NOT EXISTS queue_score ON queue (loaded, score DESC)')
+        self._conn.execute('UPDATE queue SET loaded = 0')  # 上次退出时内存中和处理中的链接重新入队
+        self._conn.commit()
+
+        self._hosts: dict[str, list[tuple[float, int, str, int, float | None]]] = {}  # 域名 -> [(-分数, id, ...)]
+        self._ready: list[tuple[float, str]] = []  # (-队首分数, 域名)，已到可抓取时间的域名
+        self._waiting: list[tuple[float, str]] = []  # (可抓取时间, 域名)
+        self._next_time: dict[str, float] = {}  # 域名 -> 下次可出队的时间
+        self._delays: dict[str, float] = {}  # 域名 -> 大于host_delay的Crawl-delay
+        self._busy: dict[str, int] = {}  # 域名 -> 已出队但还未处理完的链接数
+        self._hot_count = 0
+        self._in_flight: dict[str, tuple[int, str]] = {}  # 已出队但还未处理完的链接 -> (id, 域名)
+        self._finished: list[int] = []  # 已处理完、等待删除的链接
+        self._host_seen: dict[str, int] = dict(
+            self._conn.execute('SELECT host, COUNT(*) FROM queue GROUP BY host').fetchall()
+        )
+        self._unloaded: int = self._conn.execute('SELECT COUNT(*) FROM queue').fetchone()[0]
+        self._size: int = self._unloaded
+        self._started = self._conn.execute('SELECT COUNT(*) FROM meta').fetchone()[0] > 0
+        if self._size:
+            logger.info(f'从{file_name}.db恢复爬虫队列，剩余{self._size}个链接')
+
+    def _migrate(self) -> None:
+        """
+        旧版本的队列按入队顺序出队，没有域名和分数，补上这两列并删除已出队的部分
+        """
+        columns = [row[1] for row in self._conn.execute('PRAGMA table_info(queue)')]
+        if 'score' in columns:
+            return
+        self._conn.execute("ALTER TABLE queue ADD COLUMN host TEXT NOT NULL DEFAULT ''")
+        self._conn.execute('ALTER TABLE queue ADD COLUMN score REAL NOT NULL DEFAULT 0')
+        self._conn.execute('ALTER TABLE queue ADD COLUMN loaded INTEGER NOT NULL DEFAULT 0')
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'head'").fetchone()
+        if row:
+            self._conn.execute('DELETE FROM queue WHERE id <= ?', (row[0],))
+        seen: dict[str, int] = {}
+        rows = []
+        for item_id, url, depth, weight in self._conn.execute('SELECT id, url, depth, weight FROM queue ORDER BY id'):
+            host = ParserLink(url).netloc
+            rows.append((host, self._score(depth, weight, seen.get(host, 0)), item_id))
+            seen[host] = seen.get(host, 0) + 1
+        self._conn.executemany('UPDATE queue SET host = ?, score = ? WHERE id = ?', rows)
+
+    def _score(self, depth: int, weight: float | None, host_seen: int) -> float:
+        """
+        分数 = 父链接权重 * depth_decay^深度 / log2(2 + 该域名已入队的链接数)
+        没有父链接权重（根站、只入队不保存的链接）时按0.5计算；同一域名入队越多，后面的链接分数越低
+        """
+        weight = 0.5 if weight is None else weight
+        return weight * self._depth_decay ** depth / math.log2(2 + host_seen)
+
+    def is_new(self) -> bool:
+        return not self._started and self._size == 0
+
+    def push(self, item: Item, dedupe: bool = True) -> bool:
+        return self.push_many([item], dedupe)[0]
+
+    def push_many(self, items: list[Item], dedupe: bool = True) -> list[bool]:
+        """
+        :return: 与items等长的列表，True表示该链接已入队
+
+        dedupe为True时，先用布隆过滤器批量去重，并把新链接加入过滤器
+        """
+        if not items:
+            return []
+        if dedupe:
+            added = self._visited.add_many([item[0] for item in items]).tolist()
+        else:
+            self._visited.add_many([item[0] for item in items])
+            added = [True] * len(items)
+
+        now = time.monotonic()
+        for (url, depth, weight), ok in zip(items, added):
+            if not ok:
+                continue
+            host = ParserLink(url).netloc
+            seen = self._host_seen.get(host, 0)
+            self._host_seen[host] = seen + 1
+            score = self._score(depth, weight, seen)
+            loaded = self._hot_count < self._hot_size
+            cursor = self._conn.execute(
+                'INSERT INTO queue (url, depth, weight, host, score, loaded) VALUES (?, ?, ?, ?, ?, ?)',
+                (url, depth, weight, host, score, loaded)
+            )
+            if loaded:
+                self._add_hot((-score, cursor.lastrowid, url, depth, weight), host, now)
+            else:
+                self._unloaded += 1
+            self._size += 1
+        if not self._started:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('started', 1)")
+            self._started = True
+        self.commit()
+        return added
+
+    def _add_hot(self, entry: tuple[float, int, str, int, float | None], host: str, now: float) -> None:
+        heap = self._hosts.setdefault(host, [])
+        heapq.heappush(heap, entry)
+        self._hot_count += 1
+        if heap[0] is entry:  # 该域名的队首变了，重新登记；旧的登记在出队时发现分数不符而跳过
+            ready_time = self._next_time.get(host, 0.0)
+            if ready_time <= now:
+                heapq.heappush(self._ready, (entry[0], host))
+            else:
+                heapq.heappush(self._waiting, (ready_time, host))
+
+    def pop(self) -> Item | None:
+        """
+        :return: 已到可抓取时间的域名中分数最高的链接；队列为空或所有域名都在等待时返回None，
+                 此时可用wait_time()得到需要等待的时间
+        """
+        if self._unloaded and self._hot_count < self._hot_size // 2 + 1:
+            self._refill()
+        now = time.monotonic()
+        while self._waiting and self._waiting[0][0] <= now:
+            _, host = heapq.heappop(self._waiting)
+            heap = self._hosts.get(host)
+            if heap:
+                heapq.heappush(self._ready, (heap[0][0], host))
+
+        while self._ready:
+            neg_score, host = heapq.heappop(self._ready)
+            heap = self._hosts.get(host)
+            if not heap or heap[0][0] != neg_score or self._next_time.get(host, 0.0) > now:
+                continue
+            if self._busy.get(host, 0) >= self._host_concurrency:  # 处理完一个链接后在done()中重新登记
+                continue
+            _, item_id, url, depth, weight = heapq.heappop(heap)
+            self._next_time[host] = now + self._delays.get(host, self._host_delay)
+            self._busy[host] = self._busy.get(host, 0) + 1
+            if heap:
+                heapq.heappush(self._waiting, (self._next_time[host], host))
+            else:
+                del self._hosts[host]
+            self._hot_count -= 1
+            self._size -= 1
+            self._in_flight[url] = (item_id, host)
+            return url, depth, weight
+        return None
+
+    def set_delay(self, host: str, delay: float | None) -> None:
+        """
+        按robots.txt中的Crawl-delay设置该域名两次出队的间隔，不大于host_delay时使用host_delay
+        """
+        delay = max(self._host_delay, delay or 0.0)
+        old = self._delays.get(host, self._host_delay)
+        if delay == old:
+            return
+        if delay > self._host_delay:
+            self._delays[host] = delay
+        else:
+            del self._delays[host]
+        if host in self._next_time:  # 按新的间隔调整下次可出队的时间
+            self._next_time[host] += delay - old
+            if host in self._hosts:
+                heapq.heappush(self._waiting, (self._next_time[host], host))
+
+    def wait_time(self) -> float | None:
+        """
+        :return: 距离下一个域名可抓取还需等待的秒数，内存中没有待抓取的链接时返回None
+        """
+        if self._ready:
+            return 0.0
+        if self._waiting:
+            return max(self._waiting[0][0] - time.monotonic(), 0.0)
+        return 0.0 if self._unloaded else None
+
+    def done(self, url: str) -> None:
+        """
+        标记出队的链接已处理完，每处理完compact_interval个链接从数据库中删除一次
+        """
+        entry = self._in_flight.pop(url, None)
+        if entry is None:
+            return
+        item_id, host = entry
+        busy = self._busy.pop(host) - 1
+        if busy:
+            self._busy[host] = busy
+        if busy + 1 >= self._host_concurrency and host in self._hosts:  # 并发数已满时出队会跳过该域名，重新登记
+            heapq.heappush(self._waiting, (self._next_time.get(host, 0.0), host))
+        self._finished.append(item_id)
+        if len(self._finished) >= self._compact_interval:
+            self._evict()
+            self.commit()
+
+    def _evict(self) -> None:
+        """
+        删除内存中没有待抓取链接、没有处理中的链接且已过间隔时间的域名的记录
+        """
+        now = time.monotonic()
+        for host in [host for host, ready_time in self._next_time.items() if ready_time <= now]:
+            if host not in self._hosts and host not in self._busy:
+                del self._next_time[host]
+                self._delays.pop(host, None)
+
+    def _refill(self) -> None:
+        rows = self._conn.execute(
+            'SELECT id, url, depth, weight, host, score FROM queue WHERE loaded = 0 ORDER BY score DESC LIMIT ?',
+            (self._hot_size - self._hot_count,)
+        ).fetchall()
+        if not rows:
+            self._unloaded = 0
+            return
+        self._conn.executemany('UPDATE queue SET loaded = 1 WHERE id = ?', [(row[0],) for row in rows])
+        self._conn.commit()
+        self._unloaded -= len(rows)
+        now = time.monotonic()
+        for item_id, url, depth, weight, host, score in rows:
+            self._add_hot((-score, item_id, url, depth, weight), host, now)
+
+    def commit(self) -> None:
+        """
+        删除已处理完的链接，还在处理中的链接保留在数据库中，崩溃后重新抓取
+        """
+        if self._finished:
+            self._conn.executemany('DELETE FROM queue WHERE id = ?', [(item_id,) for item_id in self._finished])
+            self._finished = []
+        self._conn.commit()
+
+    def close(self) -> None:
+        self.commit()
+        self._conn.close()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __bool__(self) -> bool:
+        return self._size > 0
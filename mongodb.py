@@ -1,10 +1,15 @@
+import atexit
+import threading
+import time
 from typing import Any, Mapping
 
 from loguru import logger
-from pymongo import ASCENDING, DESCENDING
+from pymongo import ASCENDING, DESCENDING, UpdateOne
 from pymongo.collection import Collection
 from pymongo.cursor import Cursor
+from pymongo.errors import BulkWriteError, OperationFailure
 
+from config import mongodb_bulk_size, mongodb_bulk_interval
 from utils import cost_time
 
 
@@ -80,3 +85,118 @@ def update(col: Collection, query: dict[str, str], new_value: dict[dict[str, str
 def search_key(key: str, col: Collection) -> Cursor[Mapping[str, Any]]:
     results = col.find({'key': key}, projection={"_id": 0, "key": 0})
     return results
+
+
+def ensure_unique_index(col: Collection, key: str = 'href') -> None:
+    """
+    为key建立唯一索引，集合中已有重复数据时先用del_repeat()去重一次
+    """
+    try:
+        col.create_index([(key, ASCENDING)], unique=True)
+    except OperationFailure as e:
+        if e.code != 11000:  # 不是重复键错误
+            raise
+        logger.warning(f'{col.name}中{key}有重复的数据，去重后再建立唯一索引')
+        del_repeat(col, key, col.name)
+        col.create_index([(key, ASCENDING)], unique=True)
+
+
+class BulkWriter:
+    """
+    批量写入
+    数据先放入缓冲区，攒够batch_size条或距上次写入超过flush_interval秒时，用无序的bulk_write以key为条件upsert，
+    同一个key的数据只保留最后一条，集合中已有的文档只更新传入的字段；insert_only中的字段只在插入新文档时写入
+    （$setOnInsert），已有文档保留原值，重新抓取时不会覆盖反向链接整理器累加的权重。
+    key上有唯一索引，不会再产生重复数据；退出时（close()或进程结束）写入缓冲区中剩余的数据。
+    写入其他存储时重写_prepare()和_write()。
+    """
+
+    def __init__(self, col: Collection, key: str = 'href', batch_size: int = mongodb_bulk_size,
+                 flush_interval: float = mongodb_bulk_interval, insert_only: tuple[str, ...] = ('weight',)):
+        self.col = col
+        self.key = key
+        self.insert_only = insert_only
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.written = 0
+
+        self._buffer: dict[Any, dict] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._closed = False
+
+        self._prepare()
+        self._thread = threading.Thread(target=self._run, name='bulk-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _prepare(self) -> None:
+        ensure_unique_index(self.col, self.key)
+
+    def _write(self, datas: list[dict]) -> None:
+        """
+        写入一批数据，失败时抛出异常，数据会放回缓冲区
+        """
+        operations = [UpdateOne({self.key: data[self.key]}, self._update(data), upsert=True) for data in datas]
+        try:
+            self.col.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:  # 部分数据有问题，其余数据已写入，不再重试
+            logger.error(f'批量写入{len(operations)}条数据时有{len(e.details["writeErrors"])}条出错：'
+                         f'{e.details["writeErrors"][:3]}')
+
+    def _update(self, data: dict) -> dict[str, dict]:
+        update = {'$set': {field: value for field, value in data.items() if field not in self.insert_only}}
+        on_insert = {field: value for field, value in data.items() if field in self.insert_only}
+        if on_insert:
+            update['$setOnInsert'] = on_insert
+        return update
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def add(self, datas: list[dict]) -> None:
+        if len(datas) == 0:
+            logger.info("保存数据时所接受的列表为空")
+            return
+        with self._lock:
+            for data in datas:
+                self._buffer[data[self.key]] = data
+            full = len(self._buffer) >= self.batch_size
+        if full:
+            self.flush()
+
+    def flush(self) -> None:
+        with self._flush_lock:  # 保证同一时间只有一个线程在写入，后写入的数据不会被先写入的覆盖
+            with self._lock:
+                if not self._buffer:
+                    return
+                datas, self._buffer = self._buffer, {}
+            t = time.perf_counter()
+            try:
+                self._write(list(datas.values()))
+            except Exception as e:
+                logger.error(f'批量写入{len(datas)}条数据出错：{e}')
+                with self._lock:  # 放回缓冲区，下次再写入，期间新加入的数据优先
+                    self._buffer = {**datas, **self._buffer}
+                return
+            self.written += len(datas)
+            logger.info(f'批量写入{len(datas)}条数据，耗时：{time.perf_counter() - t:.4f}s')
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._stop.set()
+        self.flush()
+        atexit.unregister(self.close)
+
+    def __len__(self) -> int:
+        return len(self._buffer)
+
+    def __enter__(self) -> 'BulkWriter':
+        return self
+
+    def __exit__(self, exc_type: Any, exc_val: Any, exc_tb: Any) -> None:
+        self.close()
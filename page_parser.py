@@ -0,0 +1,80 @@
+import re
+from html import unescape
+
+from lxml import etree
+
+_chunk_size = 8192
+
+# 只匹配a标签的href属性，不构建文档树；script、style和注释整段跳过，其中形似链接的字符串不会被取出
+_link_pattern = re.compile(
+    r'<script\b.*?</script\s*>|<style\b.*?</style\s*>|<!--.*?-->'
+    r'|<a\s[^>]*?\bhref\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s"\'>]+))',
+    re.IGNORECASE | re.DOTALL
+)
+_body_pattern = re.compile(r'<body\b', re.IGNORECASE)
+_tag_pattern = re.compile(
+    r'<script\b.*?</script\s*>|<style\b.*?</style\s*>|<!--.*?-->|<[^>]*>',
+    re.IGNORECASE | re.DOTALL
+)
+_space_pattern = re.compile(r'\s+')
+
+
+def extract_head(text: str) -> dict[str, str | None]:
+    """
+    流式解析页面头部，读到</head>或<body>即停止
+    :return: {'title', 'keywords', 'description', 'canonical'}，不存在的字段为None
+    """
+    head = {'title': None, 'keywords': None, 'description': None, 'canonical': None}
+    parser = etree.HTMLPullParser(events=('start', 'end'))
+    for start in range(0, len(text), _chunk_size):
+        parser.feed(text[start:start + _chunk_size])
+        for event, element in parser.read_events():
+            tag = element.tag
+            if not isinstance(tag, str):  # 注释等节点
+                continue
+            if event == 'start':
+                if tag == 'body':
+                    return head
+                continue
+            if tag == 'head':
+                return head
+            if tag == 'title' and head['title'] is None:
+                head['title'] = element.text or ''
+            elif tag == 'meta':
+                name = (element.get('name') or '').lower()
+                if name in ('keywords', 'description') and head[name] is None:
+                    head[name] = element.get('content') or ''
+            elif tag == 'link' and head['canonical'] is None:
+                if 'canonical' in (element.get('rel') or '').lower().split():
+                    head['canonical'] = element.get('href')
+    return head
+
+
+def extract_links(text: str) -> list[str]:
+    """
+    用正则扫描一遍页面，取出所有a标签的href
+    """
+    links = []
+    for match in _link_pattern.finditer(text):
+        if match.group(1) is not None:
+            link = match.group(1)
+        elif match.group(2) is not None:
+            link = match.group(2)
+        elif match.group(3) is not None:
+            link = match.group(3)
+        else:
+            continue
+        links.append(unescape(link) if '&' in link else link)
+    return links
+
+
+def extract_text(text: str, max_size: int | None = None) -> str:
+    """
+    用正则去掉<body>之前的部分、标签、script、style和注释，得到正文文本
+    :param max_size: 最多返回的字符数
+    """
+    match = _body_pattern.search(text)
+    if match:
+        text = text[match.start():]
+    text = _space_pattern.sub(' ', unescape(_tag_pattern.sub(' ', text))).strip()
+    return text[:max_size] if max_size else text
@@ -0,0 +1,208 @@
+try:
+    import numpy as np
+except ImportError:
+    raise ImportError('Requires numpy')
+
+from config import postings_block_size
+
+_empty = np.empty(0, dtype=np.int64)
+
+
+def _varint_sizes(values: np.ndarray) -> np.ndarray:
+    sizes = np.ones(len(values), dtype=np.int64)
+    for k in range(1, 10):
+        sizes += values >= np.uint64(1 << (7 * k))
+    return sizes
+
+
+def _encode_varints(values: np.ndarray) -> bytes:
+    """
+    每个数按7位一组从低到高写入，除最后一组外最高位为1
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    if len(values) == 0:
+        return b''
+    sizes = _varint_sizes(values)
+    starts = np.cumsum(sizes) - sizes
+    out = np.empty(int(sizes.sum()), dtype=np.uint8)
+    for k in range(int(sizes.max())):
+        mask = sizes > k
+        groups = (values[mask] >> np.uint64(7 * k)) & np.uint64(0x7f)
+        out[starts[mask] + k] = groups | ((sizes[mask] > k + 1) << 7).astype(np.uint64)
+    return out.tobytes()
+
+
+def _decode_varints(buf: np.ndarray) -> np.ndarray:
+    if len(buf) == 0:
+        return np.empty(0, dtype=np.uint64)
+    ends = np.flatnonzero(buf < 0x80)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    shifts = (np.arange(len(buf)) - np.repeat(starts, ends - starts + 1)) * 7
+    return np.add.reduceat((buf & 0x7f).astype(np.uint64) << shifts.astype(np.uint64), starts)
+
+
+def _pack_varints(values) -> bytes:
+    """
+    _encode_varints()的纯Python版本，数量很少时比NumPy快
+    """
+    out = bytearray()
+    for value in values:
+        while value >= 0x80:
+            out.append(value & 0x7f | 0x80)
+            value >>= 7
+        out.append(value)
+    return bytes(out)
+
+
+def _read_varint(data: bytes, pos: int) -> tuple[int, int]:
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def _pack_freqs(freqs, count: int) -> tuple[int, bytes]:
+    if freqs is None:
+        return 0, b''
+    freqs = np.asarray(freqs)
+    freqs = np.minimum(freqs.reshape(count, freqs.shape[-1] if freqs.ndim > 1 else 1), 255).astype(np.uint8)
+    return freqs.shape[1], freqs.tobytes()
+
+
+def encode_postings(doc_ids, freqs=None, block_size: int = postings_block_size) -> bytes:
+    """
+    把升序且不重复的文档编号压缩为二进制
+    文档编号每block_size个分为一块，块内保存与前一个编号的差值（varint），块首编号和块的字节数写在跳表中，
+    查找时根据跳表只解码可能包含目标编号的块。
+    freqs为每个文档在各字段中的词频（count行fields列），以uint8（超过255按255）保存在各块之后，可按位置直接读取。
+    格式：varint(数量) varint(block_size) varint(字段数) varint(跳表字节数)
+         跳表[varint(块首编号差值) varint(块字节数)] 各块 词频
+    """
+    count = len(doc_ids)
+    fields, freq_bytes = _pack_freqs(freqs, count)
+    if count <= block_size:  # 只有一块，大多数关键词属于这种情况
+        doc_ids = [int(doc_id) for doc_id in doc_ids]
+        body = _pack_varints([b - a for a, b in zip(doc_ids, doc_ids[1:])])
+        skip_table = _pack_varints([doc_ids[0], len(body)]) if count else b''
+        return _pack_varints([count, block_size, fields, len(skip_table)]) + skip_table + body + freq_bytes
+    doc_ids = np.asarray(doc_ids, dtype=np.uint64)
+    starts = np.arange(0, count, block_size)
+    firsts = doc_ids[starts]
+    mask = np.ones(count, dtype=bool)
+    mask[starts] = False
+    deltas = np.diff(doc_ids, prepend=np.uint64(0))[mask]  # 块首以外的编号与前一个编号的差值
+    # 第i块有min(block_size, count - starts[i]) - 1个差值，按块累加每个差值的字节数得到块的字节数
+    block_bytes = np.zeros(len(starts), dtype=np.int64)
+    np.add.at(block_bytes, np.repeat(np.arange(len(starts)), np.diff(np.append(starts, count)) - 1),
+              _varint_sizes(deltas))
+    skips = np.empty(len(starts) * 2, dtype=np.uint64)
+    skips[0::2] = np.diff(firsts, prepend=np.uint64(0))
+    skips[1::2] = block_bytes
+    skip_table = _encode_varints(skips)
+    header = _encode_varints(np.array([count, block_size, fields, len(skip_table)]))
+    return header + skip_table + _encode_varints(deltas) + freq_bytes
+
+
+class PostingList:
+    """
+    encode_postings()生成的倒排记录，只解析头部和跳表，各块在需要时才解码
+    """
+
+    def __init__(self, data: bytes):
+        self.count, pos = _read_varint(data, 0)
+        self.block_size, pos = _read_varint(data, pos)
+        self.fields, pos = _read_varint(data, pos)
+        skip_size, pos = _read_varint(data, pos)
+        skips = _decode_varints(np.frombuffer(data, dtype=np.uint8, count=skip_size, offset=pos))
+        self.firsts = np.cumsum(skips[0::2]).astype(np.int64)  # 每块的第一个编号
+        self.offsets = np.concatenate(([0], np.cumsum(skips[1::2]))).astype(np.int64) + pos + skip_size
+        self._buf = np.frombuffer(data, dtype=np.uint8)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def freqs(self) -> np.ndarray:
+        """
+        :return: 与decode()的结果对应的词频，count行fields列
+        """
+        return self._buf[self.offsets[-1]:].reshape(self.count, self.fields)
+
+    def block(self, i: int) -> np.ndarray:
+        deltas = _decode_varints(self._buf[self.offsets[i]:self.offsets[i + 1]]).astype(np.int64)
+        return self.firsts[i] + np.concatenate(([0], np.cumsum(deltas)))
+
+    def decode(self) -> np.ndarray:
+        """
+        一次解码所有块，块首位置放入块首编号后整体求前缀和，再减去前面各块的累计值
+        """
+        if self.count == 0:
+            return _empty
+        if self.count <= self.block_size:
+            return self._decode_small()
+        values = np.empty(self.count, dtype=np.int64)
+        starts = np.arange(0, self.count, self.block_size)
+        mask = np.ones(self.count, dtype=bool)
+        mask[starts] = False
+        values[mask] = _decode_varints(self._buf[self.offsets[0]:self.offsets[-1]])
+        values[starts] = self.firsts
+        sums = np.cumsum(values)
+        lengths = np.diff(np.append(starts, self.count))
+        return sums - np.repeat(sums[starts] - self.firsts, lengths)
+
+    def _decode_small(self) -> np.ndarray:
+        data = self._buf.tobytes()
+        value = int(self.firsts[0])
+        values = [value]
+        pos = int(self.offsets[0])
+        for _ in range(self.count - 1):
+            delta, pos = _read_varint(data, pos)
+            value += delta
+            values.append(value)
+        return np.array(values, dtype=np.int64)
+
+    def filter(self, doc_ids: np.ndarray) -> np.ndarray:
+        """
+        :param doc_ids: 升序的文档编号
+        :return: doc_ids中也在该倒排记录里的编号，只解码跳表指向的块
+        """
+        if self.count == 0 or len(doc_ids) == 0:
+            return _empty
+        blocks = np.searchsorted(self.firsts, doc_ids, side='right') - 1
+        blocks = np.unique(blocks[blocks >= 0])
+        if len(blocks) == 0:
+            return _empty
+        candidates = np.concatenate([self.block(i) for i in blocks])
+        return np.intersect1d(doc_ids, candidates, assume_unique=True)
+
+
+def decode_postings(data: bytes) -> np.ndarray:
+    return PostingList(data).decode()
+
+
+def intersect_postings(*datas: bytes) -> np.ndarray:
+    """
+    从最短的倒排记录开始，依次用其余倒排记录的跳表过滤
+    :return: 同时出现在所有倒排记录中的文档编号（升序）
+    """
+    if not datas:
+        return _empty
+    lists = sorted((PostingList(data) for data in datas), key=len)
+    result = lists[0].decode()
+    for posting_list in lists[1:]:
+        result = posting_list.filter(result)
+        if len(result) == 0:
+            break
+    return result
+
+
+def union_postings(*datas: bytes) -> np.ndarray:
+    """
+    :return: 出现在任一倒排记录中的文档编号（升序）
+    """
+    if not datas:
+        return _empty
+    return np.unique(np.concatenate([decode_postings(data) for data in datas]))
@@ -0,0 +1,277 @@
+import asyncio
+import math
+import os
+import sqlite3
+import time
+from typing import Mapping
+
+import aiohttp
+import mmh3
+from loguru import logger
+
+from config import (
+    engine_name_en,
+    spider_concurrency,
+    recrawl_initial_interval,
+    recrawl_min_interval,
+    recrawl_max_interval,
+    recrawl_history,
+    recrawl_batch,
+)
+from crawler import HostLimiter
+from fetcher import is_html, read_limited_async, decode_html, new_async_session
+from robots import RobotsParser
+from spider import page_head
+from storage import Storage, get_storage
+from utils import ParserLink
+
+
+class RecrawlStore:
+    """
+    重抓记录
+    每个链接保存ETag、Last-Modified、内容哈希、上次抓取时间和下次抓取时间，存放在./temp/{file_name}（SQLite）。
+    每次检查后根据最近recrawl_history次检查中发现变化的次数估计页面的变化频率，变化越频繁重抓间隔越短。
+    """
+
+    def __init__(self, file_name: str = 'recrawl.db', initial_interval: float = recrawl_initial_interval,
+                 min_interval: float = recrawl_min_interval, max_interval: float = recrawl_max_interval,
+                 history: int = recrawl_history):
+        os.makedirs('./temp', exist_ok=True)
+        self._initial_interval = initial_interval
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._history = history
+
+        self._conn = sqlite3.connect(f'./temp/{file_name}', check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS pages ('
+            'href TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, content_hash TEXT, '
+            'last_fetch REAL, next_fetch REAL NOT NULL, interval REAL NOT NULL, '
+            'checks REAL NOT NULL DEFAULT 0, changes REAL NOT NULL DEFAULT 0, observed REAL NOT NULL DEFAULT 0)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS pages_next_fetch ON pages (next_fetch)')
+        self._conn.commit()
+
+    def add_many(self, hrefs: list[str], now: float | None = None) -> int:
+        """
+        登记新链接，已登记的链接不变
+        :return: 新登记的链接数
+        """
+        now = time.time() if now is None else now
+        before = self._conn.total_changes
+        self._conn.executemany(
+            'INSERT OR IGNORE INTO pages (href, next_fetch, interval) VALUES (?, ?, ?)',
+            [(href, now, self._initial_interval) for href in hrefs]
+        )
+        self._conn.commit()
+        return self._conn.total_changes - before
+
+    def due(self, limit: int, now: float | None = None) -> list[tuple[str, str | None, str | None, str | None]]:
+        """
+        :return: 到期需要重抓的链接，按到期时间排序，每项为(链接, ETag, Last-Modified, 内容哈希)
+        """
+        now = time.time() if now is None else now
+        return self._conn.execute(
+            'SELECT href, etag, last_modified, content_hash FROM pages WHERE next_fetch <= ? '
+            'ORDER BY next_fetch LIMIT ?', (now, limit)
+        ).fetchall()
+
+    def _estimate(self, checks: float, changes: float, observed: float, interval: float) -> float:
+        """
+        按Cho和Garcia-Molina的估计量 r = -ln((n - X + 0.5) / (n + 0.5)) / I 估计变化频率，
+        n为检查次数，X为发现变化的次数，I为平均检查间隔；重抓间隔取1/r。
+        一直没有发现变化时估计值为0，此时把间隔逐步加倍，而不是直接跳到上限。
+        """
+        rate = -math.log((checks - changes + 0.5) / (checks + 0.5)) / (observed / checks)
+        if rate <= 0:
+            return min(interval * 2, self._max_interval)
+        return min(max(1 / rate, self._min_interval), self._max_interval)
+
+    def record(self, href: str, changed: bool, etag: str | None, last_modified: str | None,
+               content_hash: str | None, now: float | None = None) -> float:
+        """
+        记录一次成功的检查（200或304）并安排下次重抓
+        首次抓取只建立ETag、Last-Modified和内容哈希的基准，不计入变化频率
+        :return: 新的重抓间隔（秒）
+        """
+        now = time.time() if now is None else now
+        row = self._conn.execute(
+            'SELECT last_fetch, interval, checks, changes, observed FROM pages WHERE href = ?', (href,)
+        ).fetchone()
+        if row is None:
+            last_fetch, interval, checks, changes, observed = None, self._initial_interval, 0, 0, 0
+        else:
+            last_fetch, interval, checks, changes, observed = row
+
+        if last_fetch is not None:
+            checks += 1
+            changes += changed
+            observed += max(now - last_fetch, 1)
+            if checks > self._history:  # 只参考最近的检查，页面更新节奏改变后能较快跟上
+                scale = self._history / checks
+                checks, changes, observed = checks * scale, changes * scale, observed * scale
+            interval = self._estimate(checks, changes, observed, interval)
+
+        self._conn.execute(
+            'INSERT OR REPLACE INTO pages '
+            '(href, etag, last_modified, content_hash, last_fetch, next_fetch, interval, checks, changes, observed) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (href, etag, last_modified, content_hash, now, now + interval, interval, checks, changes, observed)
+        )
+        return interval
+
+    def postpone(self, href: str, now: float | None = None) -> None:
+        """
+        抓取失败时按当前间隔推迟，不更新变化频率
+        """
+        now = time.time() if now is None else now
+        self._conn.execute('UPDATE pages SET next_fetch = ? + interval WHERE href = ?', (now, href))
+
+    def commit(self) -> None:
+        self._conn.commit()
+
+    def close(self) -> None:
+        self._conn.commit()
+        self._conn.close()
+
+    def __len__(self) -> int:
+        return self._conn.execute('SELECT COUNT(*) FROM pages').fetchone()[0]
+
+
+def content_hash(body: bytes) -> str:
+    return mmh3.hash_bytes(body).hex()
+
+
+class Recrawler:
+    """
+    增量重抓
+    只抓取RecrawlStore中到期的链接，并带上If-None-Match和If-Modified-Since发送条件请求。
+    304或内容哈希未变时只更新重抓记录，不解析页面也不改写数据库中的文档；内容变化时重新解析头部并更新文档。
+    """
+
+    def __init__(self, concurrency: int = spider_concurrency, store: RecrawlStore | None = None):
+        self.concurrency = concurrency
+        self.store = store if store is not None else RecrawlStore()
+        self.robots_parser = RobotsParser(user_agent=engine_name_en)
+        self.limiter = HostLimiter()
+        self.stats = {'new': 0, 'not_modified': 0, 'unchanged': 0, 'changed': 0, 'failed': 0}
+
+        self._session: aiohttp.ClientSession | None = None
+        self._storage: Storage = get_storage()
+
+    def sync(self) -> int:
+        """
+        把数据库中还没有重抓记录的链接登记进来
+        """
+        added = 0
+        batch = []
+        for data in self._storage.find_pages(['href']):
+            batch.append(data['href'])
+            if len(batch) >= 1000:
+                added += self.store.add_many(batch)
+                batch = []
+        if batch:
+            added += self.store.add_many(batch)
+        return added
+
+    async def run(self, limit: int = recrawl_batch) -> dict[str, int]:
+        async with new_async_session(self.concurrency) as session:
+            self._session = session
+            added = await asyncio.to_thread(self.sync)
+            if added:
+                logger.info(f'新登记{added}个重抓链接')
+
+            queue: asyncio.Queue = asyncio.Queue()
+            for row in self.store.due(limit):
+                queue.put_nowait(row)
+            logger.info(f'本次重抓{queue.qsize()}个到期链接，共{len(self.store)}个链接')
+            workers = [asyncio.create_task(self._worker(queue)) for _ in range(self.concurrency)]
+            try:
+                await asyncio.gather(*workers)
+            finally:
+                for worker in workers:
+                    worker.cancel()
+                self.store.commit()
+        logger.info(f'重抓结束：建立基准{self.stats["new"]}，未修改（304）{self.stats["not_modified"]}，'
+                    f'内容未变{self.stats["unchanged"]}，已更新{self.stats["changed"]}，失败{self.stats["failed"]}')
+        return self.stats
+
+    async def _worker(self, queue: asyncio.Queue) -> None:
+        while not queue.empty():
+            href, etag, last_modified, old_hash = queue.get_nowait()
+            try:
+                await self._recrawl(href, etag, last_modified, old_hash)
+            except Exception as e:
+                logger.error(f'重抓 {href} 出错：{e}')
+                self.stats['failed'] += 1
+                self.store.postpone(href)
+            finally:
+                self.store.commit()
+
+    async def _fetch(self, href: str, etag: str | None,
+                     last_modified: str | None) -> tuple[int, Mapping[str, str], bytes] | None:
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        async with self.limiter.slot(ParserLink(href).netloc, self.robots_parser.crawl_delay(href)):
+            try:
+                async with self._session.get(href, headers=headers) as response:
+                    if response.status == 304:
+                        return 304, response.headers, b''
+                    if response.status != 200 or not is_html(response.headers.get('Content-Type')):
+                        return None
+                    return 200, response.headers, await read_limited_async(response)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                logger.error(f'访问 {href} 出错：{e}')
+                return None
+
+    async def _recrawl(self, href: str, etag: str | None, last_modified: str | None, old_hash: str | None) -> None:
+        if not await asyncio.to_thread(self.robots_parser.can_crawl, href):
+            logger.warning(f'{href}不允许爬')
+            self.stats['failed'] += 1
+            self.store.postpone(href)
+            return
+
+        result = await self._fetch(href, etag, last_modified)
+        if result is None:
+            self.stats['failed'] += 1
+            self.store.postpone(href)
+            return
+        status, headers, body = result
+        etag = headers.get('ETag', etag)
+        last_modified = headers.get('Last-Modified', last_modified)
+
+        if status == 304:
+            self.stats['not_modified'] += 1
+            self.store.record(href, False, etag, last_modified, old_hash)
+            return
+
+        new_hash = content_hash(body)
+        if new_hash == old_hash:
+            self.stats['unchanged'] += 1
+            self.store.record(href, False, etag, last_modified, new_hash)
+            return
+
+        if old_hash is None:  # 首次抓取只建立基准，文档由爬虫保存时已是最新
+            self.stats['new'] += 1
+            self.store.record(href, False, etag, last_modified, new_hash)
+            return
+
+        head = page_head(href, decode_html(body, headers.get('Content-Type')))
+        if head is not None:
+            await asyncio.to_thread(self._storage.update_page, href, {
+                'title': head['title'],
+                'keywords': head['keywords'],
+                'description': head['description'],
+            })
+            logger.info(f'{href} 内容已变化，已更新')
+        self.stats['changed'] += 1
+        self.store.record(href, True, etag, last_modified, new_hash)
+
+
+async def recrawl(limit: int = recrawl_batch, concurrency: int = spider_concurrency) -> dict[str, int]:
+    return await Recrawler(concurrency).run(limit)
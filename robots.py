@@ -0,0 +1,222 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+from urllib.parse import urlparse, unquote
+
+from loguru import logger
+
+from config import engine_name_en, robots_ttl, robots_negative_ttl, robots_error_ttl
+from fetcher import fetch
+
+_disallow_all = 'User-agent: *\nDisallow: /'
+
+
+def _product_token(user_agent: str) -> str:
+    """
+    User-agent中的产品名，例如TY-Spider/1.0为ty-spider
+    """
+    return re.split(r'[/\s]', user_agent.strip(), maxsplit=1)[0].lower()
+
+
+class RobotsRules:
+    """
+    编译后的robots规则
+    普通的路径前缀规则存入前缀树，检查时沿路径逐字符向下走一遍即可找到最长匹配，复杂度为O(路径长度)；
+    含有*或$的规则编译为正则单独匹配。
+    与Google的实现一致：匹配长度最长的规则生效，长度相同时Allow优先。
+    """
+
+    _rule = '\0'  # 前缀树节点中保存规则的键，不会出现在路径中
+
+    def __init__(self, allow: list[str] | None = None, disallow: list[str] | None = None,
+                 crawl_delay: float | None = None):
+        self.crawl_delay = crawl_delay
+        self._trie: dict = {}
+        self._patterns: list[tuple[re.Pattern, int, bool]] = []
+        for path in allow or []:
+            self._add(path, True)
+        for path in disallow or []:
+            self._add(path, False)
+
+    def _add(self, path: str, allow: bool) -> None:
+        if not path:  # 空的Disallow表示全部允许
+            return
+        if '*' in path or path.endswith('$'):
+            pattern = re.escape(path).replace(r'\*', '.*')
+            if pattern.endswith(r'\$'):
+                pattern = pattern[:-2] + '$'
+            self._patterns.append((re.compile(pattern), len(path), allow))
+            return
+        node = self._trie
+        for char in path:
+            node = node.setdefault(char, {})
+        # 同一路径同时出现在Allow和Disallow中时Allow优先
+        node[self._rule] = node.get(self._rule, False) or allow
+
+    def can_fetch(self, path: str) -> bool:
+        best_len, best_allow = -1, True
+        node = self._trie
+        if self._rule in node:
+            best_len, best_allow = 0, node[self._rule]
+        for i, char in enumerate(path):
+            node = node.get(char)
+            if node is None:
+                break
+            if self._rule in node:
+                best_len, best_allow = i + 1, node[self._rule]
+        for pattern, length, allow in self._patterns:
+            if length >= best_len and pattern.match(path):
+                if length > best_len or allow:
+                    best_len, best_allow = length, allow
+        return best_allow
+
+    @classmethod
+    def parse(cls, robots_txt: str, user_agent: str = engine_name_en) -> 'RobotsRules':
+        """
+        按组解析robots.txt，User-agent按产品名匹配（不区分大小写），同名的组合并
+        产品名与本爬虫的相同，或是其以-分隔的前缀（如ty之于ty-spider）时匹配，有多个时最长的生效，都不匹配时使用*组
+        """
+        groups: dict[str, dict] = {}
+        agents: list[str] = []
+        in_rules = False
+        token = _product_token(user_agent)
+
+        for line in robots_txt.splitlines():
+            line = line.split('#', 1)[0].strip()
+            if ':' not in line:
+                continue
+            field, value = line.split(':', 1)
+            field, value = field.strip().lower(), value.strip()
+
+            if field == 'user-agent':
+                if in_rules:  # 规则之后出现的User-agent开始一个新组
+                    agents = []
+                    in_rules = False
+                name = _product_token(value)
+                if not name:  # 空的User-agent不属于任何爬虫
+                    continue
+                agents.append(name)
+                groups.setdefault(name, {'allow': [], 'disallow': [], 'crawl_delay': None})
+            elif field in ('allow', 'disallow', 'crawl-delay'):
+                in_rules = True
+                for name in agents:
+                    group = groups[name]
+                    if field == 'crawl-delay':
+                        try:
+                            group['crawl_delay'] = float(value)
+                        except ValueError:
+                            pass
+                    else:
+                        group[field].append(unquote(value))
+
+        names = [name for name in groups if name == token or token.startswith(name + '-')]
+        group = groups[max(names, key=len)] if names else groups.get('*')
+        if group is None:
+            return cls()
+        return cls(group['allow'], group['disallow'], group['crawl_delay'])
+
+
+class RobotsParser:
+    """
+    robots.txt检查
+    规则按域名缓存并在robots_ttl秒后过期，不存在（4xx）的robots.txt视为全部允许，缓存robots_negative_ttl秒；
+    返回5xx、429或无法访问时暂时视为全部禁止，robots_error_ttl秒后重新获取。
+    获取到的robots.txt同时写入./temp/robots.db，多个爬虫进程共用，未过期时不会重复下载。
+    """
+
+    def __init__(self, user_agent: str = engine_name_en, file_name: str | None = 'robots.db',
+                 ttl: float = robots_ttl, negative_ttl: float = robots_negative_ttl,
+                 error_ttl: float = robots_error_ttl):
+        self._user_agent = user_agent
+        self._ttl = ttl
+        self._negative_ttl = negative_ttl
+        self._error_ttl = error_ttl
+        self._rules: dict[str, tuple[RobotsRules, float]] = {}  # 域名 -> (规则, 过期时间)
+        self._locks: dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+        self._conn = None
+        if file_name is not None:
+            os.makedirs('./temp', exist_ok=True)
+            self._conn = sqlite3.connect(f'./temp/{file_name}', check_same_thread=False, timeout=10)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS robots (host TEXT PRIMARY KEY, body TEXT, expires REAL NOT NULL)'
+            )
+            self._conn.commit()
+
+    def _fetch_robots_txt(self, base_url: str) -> tuple[str | None, float]:
+        """
+        :return: (robots.txt内容, 缓存时间)，不存在时内容为None；服务器出错或无法访问时为全部禁止的规则
+        """
+        try:
+            res = fetch(base_url + '/robots.txt', headers={'User-Agent': self._user_agent})
+        except Exception as e:
+            logger.error(f'获取robots.txt文件时出错：{e}')
+            res = None
+        if res is None or res.status_code >= 500 or res.status_code == 429:
+            logger.warning(f'{base_url}的robots.txt暂时无法获取，{self._error_ttl}秒内不抓取该域名')
+            return _disallow_all, self._error_ttl
+        if res.status_code != 200:
+            return None, self._negative_ttl
+        return res.text, self._ttl
+
+    def _load(self, base_url: str) -> tuple[str | None, float] | None:
+        if self._conn is None:
+            return None
+        with self._lock:
+            row = self._conn.execute('SELECT body, expires FROM robots WHERE host = ?', (base_url,)).fetchone()
+        if row is None or row[1] <= time.time():
+            return None
+        return row[0], row[1]
+
+    def _store(self, base_url: str, body: str | None, expires: float) -> None:
+        if self._conn is None:
+            return
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO robots (host, body, expires) VALUES (?, ?, ?)',
+                               (base_url, body, expires))
+            self._conn.commit()
+
+    def get_rules(self, url: str) -> RobotsRules:
+        parser_url = urlparse(url)
+        base_url = f'{parser_url.scheme}://{parser_url.netloc}'.lower()
+
+        cached = self._rules.get(base_url)
+        if cached and cached[1] > time.time():
+            return cached[0]
+
+        with self._lock:
+            host_lock = self._locks.setdefault(base_url, threading.Lock())
+        with host_lock:  # 同一域名只下载一次
+            cached = self._rules.get(base_url)
+            if cached and cached[1] > time.time():
+                return cached[0]
+
+            stored = self._load(base_url)
+            if stored is not None:
+                body, expires = stored
+            else:
+                body, ttl = self._fetch_robots_txt(base_url)
+                expires = time.time() + ttl
+                self._store(base_url, body, expires)
+            rules = RobotsRules.parse(body, self._user_agent) if body else RobotsRules()
+            self._rules[base_url] = (rules, expires)
+            return rules
+
+    def can_crawl(self, url: str) -> bool:
+        parser_url = urlparse(url)
+        if not parser_url.scheme.startswith('http'):
+            return True
+        path = parser_url.path or '/'
+        if parser_url.query:
+            path += '?' + parser_url.query
+        return self.get_rules(url).can_fetch(unquote(path))
+
+    def crawl_delay(self, url: str) -> float | None:
+        """
+        :return: robots.txt中为本爬虫设置的Crawl-delay，未设置时返回None
+        """
+        return self.get_rules(url).crawl_delay
@@ -1,5 +1,4 @@
 @echo off
-start cmd /k python spider-1.py
-start cmd /k python spider-2.py
+start cmd /k python coordinator.py
 start cmd /k python server.py
 start cmd /k python manage.py
@@ -0,0 +1,282 @@
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+from typing import Any, Iterator
+
+try:
+    import numpy as np
+except ImportError:
+    raise ImportError('Requires numpy')
+
+from loguru import logger
+
+from config import segment_dir, segment_keep, segment_reload_interval
+from data_process import BM25, new_stats
+from storage import Storage, get_storage
+
+_magic = b'TYSEG002'
+# 标识、关键词数、页面数，以及关键词、两个偏移表、页面、四个页面表和全局统计在文件中的起始位置
+_header = struct.Struct('<8s11Q')
+_current = 'CURRENT'
+_batch_size = 1000  # 导出页面时每批读取页面记录的数量
+
+
+def _path(directory: str, name: str) -> str:
+    return os.path.join('./temp', directory, name)
+
+
+def _fsync_write(path: str, data: bytes) -> None:
+    with open(path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class SegmentWriter:
+    """
+    把存储中的反向索引和页面导出为一个只读的索引段文件，写完后原子地替换CURRENT，发布为新的一代
+    文件格式（整数均为小端序，数组按8字节对齐）：
+    头部 | 各关键词的倒排记录 | 关键词（UTF-8，按字节序排列） | 关键词偏移[n+1] | 倒排记录偏移[n+1]
+        | 各页面的JSON | 文档编号[m]（升序） | 页面偏移[m] | 页面字节数[m] | 各字段长度[m][字段数] | 全局统计（JSON）
+    全局统计和字段长度由导出的页面记录重新计算，供BM25打分使用。
+    """
+
+    def __init__(self, directory: str = segment_dir, keep: int = segment_keep):
+        self.directory = directory
+        self.keep = keep
+        os.makedirs(_path(directory, ''), exist_ok=True)
+
+    def _generations(self) -> list[int]:
+        return sorted(int(name[8:-4]) for name in os.listdir(_path(self.directory, ''))
+                      if name.startswith('segment_') and name.endswith('.seg'))
+
+    def write(self, storage: Storage | None = None) -> str:
+        """
+        :return: 新索引段的文件名
+        """
+        storage = storage if storage is not None else get_storage()
+        generations = self._generations()
+        name = f'segment_{(generations[-1] + 1 if generations else 1):08d}.seg'
+        tmp = _path(self.directory, name + '.tmp')
+        with open(tmp, 'wb') as f:
+            f.write(b'\0' * _header.size)
+            n_terms, postings_offsets, terms, term_offsets = self._write_postings(f, storage.iter_postings())
+            terms_start = f.tell()
+            f.write(terms)
+            term_offsets_start = self._write_array(f, term_offsets)
+            postings_offsets_start = self._write_array(f, postings_offsets)
+            docs_start = f.tell()
+            doc_ids, doc_offsets, doc_sizes, lengths, stats = self._write_docs(f, storage)
+            doc_ids_start = self._write_array(f, doc_ids)
+            doc_offsets_start = self._write_array(f, doc_offsets)
+            doc_sizes_start = self._write_array(f, doc_sizes)
+            lengths_start = self._write_array(f, lengths)
+            stats_start = f.tell()
+            f.write(json.dumps(stats).encode())
+            f.seek(0)
+            f.write(_header.pack(_magic, n_terms, len(doc_ids), terms_start, term_offsets_start,
+                                 postings_offsets_start, docs_start, doc_ids_start, doc_offsets_start, doc_sizes_start,
+                                 lengths_start, stats_start))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, _path(self.directory, name))
+        _fsync_write(_path(self.directory, _current + '.tmp'), name.encode())
+        os.replace(_path(self.directory, _current + '.tmp'), _path(self.directory, _current))
+        logger.info(f'发布索引段{name}：{n_terms}个关键词，{len(doc_ids)}个页面')
+
+        for generation in self._generations()[:-self.keep]:  # 已经打开旧索引段的进程仍可继续读取
+            os.remove(_path(self.directory, f'segment_{generation:08d}.seg'))
+        return name
+
+    @staticmethod
+    def _write_postings(f, postings: Iterator[tuple[str, bytes]]) -> tuple[int, array, bytearray, array]:
+        postings_offsets = array('Q', [f.tell()])
+        terms = bytearray()
+        term_offsets = array('Q', [0])
+        last = None
+        for key, value in postings:
+            term = key.encode()
+            if last is not None and term <= last:
+                raise ValueError(f'倒排记录没有按关键词排序：{key}')
+            last = term
+            f.write(value)
+            postings_offsets.append(f.tell())
+            terms += term
+            term_offsets.append(len(terms))
+        return len(term_offsets) - 1, postings_offsets, terms, term_offsets
+
+    @staticmethod
+    def _write_docs(f, storage: Storage) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, dict[str, Any]]:
+        """
+        页面按读取顺序写入，各表按文档编号排序；还没有文档编号的页面不会被查到，不写入
+        :return: 文档编号、页面偏移、页面字节数、各字段长度、全局统计
+        """
+        doc_ids, offsets, sizes, lengths = array('q'), array('Q'), array('Q'), array('I')
+        stats = new_stats()
+        fields = len(stats['lengths'])
+
+        def write_batch(batch: list[dict[str, Any]]) -> None:
+            records = storage.get_doc_terms([data['doc_id'] for data in batch])
+            for data in batch:
+                body = json.dumps(data, ensure_ascii=False).encode()
+                doc_ids.append(data['doc_id'])
+                offsets.append(f.tell())
+                sizes.append(len(body))
+                f.write(body)
+                record = records.get(data['doc_id'])
+                lengths.extend(record['lengths'] if record else [0] * fields)
+                if record:
+                    stats['doc_count'] += 1
+                    stats['lengths'] = [total + length for total, length in zip(stats['lengths'], record['lengths'])]
+
+        batch = []
+        for data in storage.find_pages():
+            if data.get('doc_id') is None:
+                continue
+            batch.append(data)
+            if len(batch) >= _batch_size:
+                write_batch(batch)
+                batch = []
+        if batch:
+            write_batch(batch)
+        order = np.argsort(np.frombuffer(doc_ids, dtype=np.int64), kind='stable')
+        return (np.frombuffer(doc_ids, dtype=np.int64)[order], np.frombuffer(offsets, dtype=np.uint64)[order],
+                np.frombuffer(sizes, dtype=np.uint64)[order],
+                np.frombuffer(lengths, dtype=np.uint32).reshape(-1, fields)[order], stats)
+
+    @staticmethod
+    def _write_array(f, values: array | np.ndarray) -> int:
+        f.write(b'\0' * (-f.tell() % 8))
+        start = f.tell()
+        f.write(np.asarray(values).tobytes())
+        return start
+
+
+class Segment:
+    """
+    用mmap打开的只读索引段，查询只读内存，多个进程打开同一个文件时共用操作系统的页缓存
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.n_terms, self.n_docs, terms_start, term_offsets_start, postings_offsets_start, docs_start,
+         doc_ids_start, doc_offsets_start, doc_sizes_start, lengths_start,
+         stats_start) = _header.unpack_from(self._mmap)
+        if magic != _magic:
+            raise ValueError(f'{path}不是索引段文件')
+        self.stats: dict[str, Any] = json.loads(self._mmap[stats_start:])
+        self.scorer = BM25(self.stats)
+        self._terms_start = terms_start
+        self._term_offsets = np.frombuffer(self._mmap, dtype='<u8', count=self.n_terms + 1, offset=term_offsets_start)
+        self._postings_offsets = np.frombuffer(self._mmap, dtype='<u8', count=self.n_terms + 1,
+                                               offset=postings_offsets_start)
+        self._doc_ids = np.frombuffer(self._mmap, dtype='<i8', count=self.n_docs, offset=doc_ids_start)
+        self._doc_offsets = np.frombuffer(self._mmap, dtype='<u8', count=self.n_docs, offset=doc_offsets_start)
+        self._doc_sizes = np.frombuffer(self._mmap, dtype='<u8', count=self.n_docs, offset=doc_sizes_start)
+        fields = len(self.stats['lengths'])
+        self._lengths = np.frombuffer(self._mmap, dtype='<u4', count=self.n_docs * fields,
+                                      offset=lengths_start).reshape(self.n_docs, fields)
+
+    def _term(self, i: int) -> bytes:
+        start = self._terms_start + int(self._term_offsets[i])
+        return self._mmap[start:self._terms_start + int(self._term_offsets[i + 1])]
+
+    def postings(self, key: str) -> bytes | None:
+        """
+        在按字节序排列的关键词中二分查找
+        :return: 压缩的倒排记录，与Storage.search_key()相同，没有时返回None
+        """
+        term = key.encode()
+        low, high = 0, self.n_terms
+        while low < high:
+            middle = (low + high) // 2
+            if self._term(middle) < term:
+                low = middle + 1
+            else:
+                high = middle
+        if low == self.n_terms or self._term(low) != term:
+            return None
+        return self._mmap[int(self._postings_offsets[low]):int(self._postings_offsets[low + 1])]
+
+    def documents(self, doc_ids) -> list[dict[str, Any]]:
+        """
+        :return: 文档编号对应的页面，不存在的编号跳过
+        """
+        positions = self._positions(doc_ids)
+        datas = []
+        for position in positions[positions >= 0]:
+            start = int(self._doc_offsets[position])
+            datas.append(json.loads(self._mmap[start:start + int(self._doc_sizes[position])]))
+        return datas
+
+    def lengths(self, doc_ids) -> np.ndarray:
+        """
+        :return: 文档编号对应页面的各字段长度，不存在的编号为0
+        """
+        positions = self._positions(doc_ids)
+        lengths = np.zeros((len(positions), self._lengths.shape[1]), dtype=np.uint32)
+        lengths[positions >= 0] = self._lengths[positions[positions >= 0]]
+        return lengths
+
+    def _positions(self, doc_ids) -> np.ndarray:
+        """
+        :return: 文档编号在页面表中的位置，不存在的编号为-1
+        """
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        positions = np.searchsorted(self._doc_ids, doc_ids)
+        found = positions < self.n_docs
+        found[found] = self._doc_ids[positions[found]] == doc_ids[found]
+        return np.where(found, positions, -1)
+
+    def close(self) -> None:
+        del self._term_offsets, self._postings_offsets, self._doc_ids, self._doc_offsets, self._doc_sizes, self._lengths
+        self._mmap.close()
+
+
+class SegmentReader:
+    """
+    后端服务使用的索引段，按CURRENT打开最新的一代
+    每隔reload_interval秒检查一次CURRENT，发布了新的一代时打开新文件并替换引用，正在处理的查询继续使用旧的索引段。
+    """
+
+    def __init__(self, directory: str = segment_dir, reload_interval: float = segment_reload_interval):
+        self.directory = directory
+        self.reload_interval = reload_interval
+        self._segment: Segment | None = None
+        self._name: str | None = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def current(self) -> Segment | None:
+        """
+        :return: 最新的索引段，还没有发布过时返回None
+        """
+        now = time.monotonic()
+        if now - self._checked >= self.reload_interval:
+            with self._lock:
+                if now - self._checked >= self.reload_interval:
+                    self._checked = now
+                    self._reload()
+        return self._segment
+
+    def _reload(self) -> None:
+        try:
+            with open(_path(self.directory, _current), 'rb') as f:
+                name = f.read().decode().strip()
+        except FileNotFoundError:
+            return
+        if name == self._name:
+            return
+        try:
+            segment = Segment(_path(self.directory, name))
+        except (OSError, ValueError) as e:
+            logger.error(f'打开索引段{name}出错：{e}')
+            return
+        self._segment, self._name = segment, name  # 旧的索引段没有引用后由垃圾回收关闭
+        logger.info(f'加载索引段{name}：{segment.n_terms}个关键词，{segment.n_docs}个页面')
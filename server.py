@@ -1,5 +1,7 @@
+import asyncio
 from typing import Any
 
+import numpy as np
 import uvicorn
 from fastapi import FastAPI, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
@@ -8,11 +10,12 @@ from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from jieba import lcut_for_search
 
-from config import fastapi_port, db_name, data_col_name, key_col_name
-from data_process import remove_stop_words, TFIDF
-from database import MongoDB
+from config import fastapi_port
+from data_process import remove_stop_words, BM25
 from log_lg import ServerLog
-from mongodb import creat_index, search_key, find_all, search_data
+from postings import union_postings
+from segment import Segment, SegmentReader
+from storage import DocumentCache, get_storage
 
 origins = [
     "http://localhost:1314",
@@ -25,24 +28,68 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
 
 
-def get_data_use_key(list_question: list[str]) -> list[dict[str, Any]]:
-    with MongoDB(db_name, key_col_name) as key_db:
-        key_col = key_db.col
-        indexes = [result['value'] for question in list_question for result in search_key(question, key_col)]
-    indexes = list(set(sum(indexes, [])))
-
-    with MongoDB(db_name, data_col_name) as db_data:
-        col_data = db_data.col
-        all_data = list(find_all(col_data, projection={'_id': 0}))
-
-    answer = [all_data[index] for index in indexes]
-    return answer
-
-
-def get_data_use_search(list_question: list[str]) -> list[dict[str, Any]]:
-    with MongoDB(db_name, data_col_name) as data_db:
-        data_col = data_db.col
-        temp_results = [result for question in list_question for result in search_data(question, data_col)]
+segments = SegmentReader()
+documents = DocumentCache()
+# 返回结果和打分用到的页面字段，按编号读取页面时只读取这些字段
+page_fields = ['title', 'keywords', 'description', 'href', 'weight', 'netloc', 'doc_id']
+
+
+async def get_postings(list_question: list[str], segment: Segment | None) -> list[bytes]:
+    """
+    :return: 各查询关键词的倒排记录，已发布索引段时只读内存，不访问数据库
+    """
+    if segment is not None:
+        datas = [segment.postings(question) for question in set(list_question)]
+    else:
+        storage = get_storage()
+        datas = [await storage.asearch_key(question) for question in set(list_question)]
+    return [data for data in datas if data is not None]
+
+
+def _project(data: dict[str, Any]) -> dict[str, Any]:
+    """
+    只保留返回给前端的字段
+    """
+    return {field: data[field] for field in page_fields if field in data}
+
+
+async def get_data_use_key(postings: list[bytes], segment: Segment | None) -> list[dict[str, Any]]:
+    """
+    按文档编号读取命中的页面，最近查询过的页面从缓存中取，其余的从索引段读取，还没有发布过索引段时按编号批量查询数据库
+    """
+    doc_ids = union_postings(*postings).tolist()
+    if not doc_ids:
+        return []
+    source = segment.path if segment is not None else None
+    found, missing = documents.get(doc_ids, source)
+    if missing:
+        if segment is not None:
+            datas = [_project(data) for data in segment.documents(missing)]
+        else:
+            datas = await get_storage().afind_pages_by_ids(missing, page_fields)
+        documents.put(datas, source)
+        found.update((data['doc_id'], data) for data in datas)
+    return [found[doc_id] for doc_id in doc_ids if doc_id in found]
+
+
+async def get_scores(docs: list[dict[str, Any]], postings: list[bytes], segment: Segment | None) -> np.ndarray:
+    """
+    用索引时保存的词频、字段长度和全局统计计算BM25分数，还没有被索引的页面为0分
+    """
+    doc_ids = [doc.get('doc_id', -1) for doc in docs]
+    if segment is not None:
+        return segment.scorer.score(postings, doc_ids, segment.lengths(doc_ids))
+
+    storage = get_storage()
+    scorer = BM25(await asyncio.to_thread(storage.get_meta, 'stats'))
+    records = await asyncio.to_thread(storage.get_doc_terms, [doc_id for doc_id in doc_ids if doc_id >= 0])
+    lengths = [records[doc_id]['lengths'] if doc_id in records else [0] * len(scorer.boosts) for doc_id in doc_ids]
+    return scorer.score(postings, doc_ids, lengths)
+
+
+async def get_data_use_search(list_question: list[str]) -> list[dict[str, Any]]:
+    storage = get_storage()
+    temp_results = [_project(result) for question in list_question for result in await storage.asearch_pages(question)]
     return temp_results
 
 
@@ -67,22 +114,24 @@ async def search(q: str = Form()):
     list_question = lcut_for_search(q)
     list_question = remove_stop_words(list_question)
 
-    key_ans = get_data_use_key(list_question)
-    search_ans = get_data_use_search(list_question)
+    segment = segments.current()  # 同一次查询始终使用同一代索引段
+    postings = await get_postings(list_question, segment)
+    key_ans, search_ans = await asyncio.gather(get_data_use_key(postings, segment), get_data_use_search(list_question))
 
     all_ans = key_ans.copy()
+    hrefs = {item['href'] for item in all_ans}
     for item in search_ans:
-        if item not in all_ans:
+        if item['href'] not in hrefs:
+            hrefs.add(item['href'])
             all_ans.append(item)
 
-    texts = [str(doc["title"]) + " " + str(doc["description"]) + " " + str(doc["keywords"]) for doc in all_ans]
-    try:
-        ranked_indices = TFIDF(texts, list_question)
-    except ValueError:
+    if not all_ans:
         return {
             'status': 3,
             'response': '无效'
         }
+    scores = await get_scores(all_ans, postings, segment)
+    ranked_indices = np.argsort(-scores, kind='stable').tolist()  # 从高到低排列
     len_ranked_indices = len(ranked_indices)
 
     for rank, index in enumerate(ranked_indices):
@@ -97,8 +146,7 @@ async def search(q: str = Form()):
 
 if __name__ == "__main__":
     ServerLog()
-    with MongoDB(db_name, data_col_name) as db:
-        creat_index(db.col)
+    get_storage().create_indexes()
     config = uvicorn.Config("server:app", port=fastapi_port, log_level="info")
     server = uvicorn.Server(config)
     server.run()
@@ -0,0 +1,132 @@
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+
+import mmh3
+
+try:
+    import numpy as np
+except ImportError:
+    raise ImportError('Requires numpy')
+
+from config import simhash_bands, simhash_distance
+
+_token_pattern = re.compile(r'[\u4e00-\u9fff]+|[a-z0-9]+')
+_shifts = np.arange(64, dtype=np.uint64)
+
+
+def _features(text: str) -> Counter:
+    """
+    英文和数字按单词，中文按相邻两个字切分
+    """
+    features = Counter()
+    for token in _token_pattern.findall(text.lower()):
+        if '\u4e00' <= token[0] <= '\u9fff' and len(token) > 1:
+            features.update(token[i:i + 2] for i in range(len(token) - 1))
+        else:
+            features[token] += 1
+    return features
+
+
+def simhash(text: str) -> int:
+    """
+    64位SimHash，每个特征的64位哈希按位投票（1加权重，0减权重），结果大于0的位为1
+    :return: 无符号64位整数，没有特征时返回0
+    """
+    features = _features(text)
+    if not features:
+        return 0
+    hashes = np.fromiter((mmh3.hash64(feature, signed=False)[0] for feature in features),
+                         dtype=np.uint64, count=len(features))
+    weights = np.fromiter(features.values(), dtype=np.int64, count=len(features))
+    bits = ((hashes[:, None] >> _shifts) & np.uint64(1)).astype(np.int64)
+    votes = weights @ (bits * 2 - 1)
+    return int(np.packbits(votes > 0, bitorder='little').view('<u8')[0])
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def to_signed(fingerprint: int) -> int:
+    """
+    MongoDB和SQLite只能保存有符号64位整数
+    """
+    return fingerprint - (1 << 64) if fingerprint >= 1 << 63 else fingerprint
+
+
+class SimHashIndex:
+    """
+    SimHash近似重复索引
+    64位指纹分成bands段，汉明距离不超过max_distance（< bands）的两个指纹至少有一段完全相同，
+    因此只需按每一段精确查找候选，再逐个计算汉明距离。
+    索引保存在./temp/{file_name}（SQLite），多个爬虫进程共用，不同域名的镜像页面也能被发现。
+    """
+
+    def __init__(self, file_name: str | None = 'simhash.db', bands: int = simhash_bands,
+                 max_distance: int = simhash_distance):
+        if max_distance >= bands:
+            raise ValueError('max_distance必须小于bands')
+        self._bands = bands
+        self._max_distance = max_distance
+        self._band_bits = 64 // bands
+        self._lock = threading.Lock()
+
+        if file_name is None:
+            self._conn = sqlite3.connect(':memory:', check_same_thread=False)
+        else:
+            os.makedirs('./temp', exist_ok=True)
+            self._conn = sqlite3.connect(f'./temp/{file_name}', check_same_thread=False, timeout=10)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS simhash '
+            '(band INTEGER NOT NULL, key INTEGER NOT NULL, fingerprint INTEGER NOT NULL, href TEXT NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS simhash_band_key ON simhash (band, key)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS simhash_href ON simhash (href)')
+        self._conn.commit()
+
+    def _keys(self, fingerprint: int) -> list[tuple[int, int]]:
+        mask = (1 << self._band_bits) - 1
+        return [(band, (fingerprint >> (band * self._band_bits)) & mask) for band in range(self._bands)]
+
+    def _find(self, fingerprint: int, exclude: str | None = None) -> str | None:
+        for band, key in self._keys(fingerprint):
+            for other, href in self._conn.execute(
+                    'SELECT fingerprint, href FROM simhash WHERE band = ? AND key = ?', (band, key)):
+                if href != exclude and hamming(fingerprint, other & ((1 << 64) - 1)) <= self._max_distance:
+                    return href
+        return None
+
+    def find(self, fingerprint: int, exclude: str | None = None) -> str | None:
+        """
+        :param exclude: 不视为重复的链接，一般为页面自己的链接
+        :return: 近似重复页面的链接，没有时返回None
+        """
+        with self._lock:
+            return self._find(fingerprint, exclude)
+
+    def add(self, fingerprint: int, href: str) -> str | None:
+        """
+        没有近似重复页面时把指纹加入索引
+        同一链接之前加入的指纹不算重复，而是被替换，崩溃后重新入队、重置队列或再次抓取种子时页面不会与自己重复
+        :return: 已存在的近似重复页面的链接，没有时返回None（此时已加入索引）
+        """
+        with self._lock:
+            duplicate = self._find(fingerprint, href)
+            if duplicate is not None:
+                return duplicate
+            self._conn.execute('DELETE FROM simhash WHERE href = ?', (href,))
+            self._conn.executemany(
+                'INSERT INTO simhash (band, key, fingerprint, href) VALUES (?, ?, ?, ?)',
+                [(band, key, to_signed(fingerprint), href) for band, key in self._keys(fingerprint)]
+            )
+            self._conn.commit()
+            return None
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
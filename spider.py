@@ -1,154 +1,162 @@
 import multiprocessing
+import os
 import pickle
 import random
 import time
 from collections import deque
 from typing import Union, Any
-from urllib.parse import urljoin, urlparse
 
-import requests
-from bs4 import BeautifulSoup
 from loguru import logger
 
 from config import (
     engine_name_en,
     wiki,
-    db_name,
-    data_col_name,
     spider_check_memory,
+    governor_low_memory,
+    governor_min_memory,
+    governor_max_rss,
+    governor_max_sockets,
+    governor_interval,
     bloom_dataSize,
     bloom_errorRate,
+    bloom_flushInterval,
+    bloom_scalable,
+    simhash_body,
+    simhash_body_size,
+    url_skip_extensions,
 )
-from database import MongoDB
-from mongodb import save_data
+from canonical import canonicalize
+from fetcher import fetch, fetch_document
+from frontier import Frontier
+from robots import RobotsParser
+from page_parser import extract_head, extract_links, extract_text
+from simhash import SimHashIndex, simhash, to_signed
+from storage import get_storage
 from utils import (
-    Memory,
-    Schedule,
+    ResourceGovernor,
     check_lang,
+    get_lang_detector,
     ParserLink,
     BloomFilter,
+    ScalableBloomFilter,
 )
 
-_headers = {
-    'User-Agent': engine_name_en
-}
-
-
-class RobotsParser:
-    def __init__(self, user_agent: str = engine_name_en):
-        self._user_agent = user_agent
-        self._rules = {}
-
-    def _fetch_robots_txt(self, base_url: str) -> str:
-        try:
-            url = urljoin(base_url, "/robots.txt")
-            res = requests.get(url, headers={'user-agent': self._user_agent}, timeout=3)
-            if res.status_code != 200:
-                return ""
-            res.raise_for_status()
-            return res.text
-        except Exception as e:
-            logger.error(f'获取robots.txt文件时出错：{e}')
-            return ""
-
-    def _parser_robots_txt(self, robots_txt: str) -> None:
-        lines = robots_txt.split('\n')
-        current_agent = None
-
-        for line in lines:
-            line = line.strip()
-
-            if line.startswith('User-agent:'):
-                current_agent = line.split(': ')[-1]
-                self._rules[current_agent] = {'allow': [], 'disallow': []}
-            elif line.startswith('Disallow:'):
-                if current_agent is not None:
-                    self._rules[current_agent]['disallow'].append(line.split(': ')[-1])
-            elif line.startswith('Allow:'):
-                if current_agent is not None:
-                    self._rules[current_agent]['allow'].append(line.split(': ')[-1])
-
-    def can_crawl(self, url: str) -> bool:
-        parser_url = urlparse(url)
-        base_url = f'{parser_url.scheme}://{parser_url.netloc}'
-
-        if base_url not in self._rules:
-            robots_txt = self._fetch_robots_txt(base_url)
-            self._parser_robots_txt(robots_txt)
-        if base_url in self._rules:
-            rules = self._rules[base_url]
-            for path in rules['disallow']:
-                if url.startswith(urljoin(base_url, path)):
-                    return False
-            for path in rules['allow']:
-                if url.startswith(urljoin(base_url, path)):
-                    return True
-        return True
+_skip_extensions = tuple(url_skip_extensions)
 
 
-def get_keywords_and_description(url: str) -> Union[list[dict[str, Any]], None]:
-    datas = []
+def page_head(url: str, text: str) -> dict[str, str | None] | None:
+    """
+    从页面头部提取title、keywords、description和规范链接，title为空时返回None
+    """
     no_datas = ['', None, ' ']
+
+    head = extract_head(text)
+    if head['title'] in no_datas:
+        logger.info(f'{url} 的title为空')
+        return None
+    head['keywords'] = head['keywords'] or ''
+    head['description'] = head['description'] or ''
+    return head
+
+
+def head_text(head: dict[str, str | None]) -> str:
+    """
+    用于语言检测的文本
+    """
+    return head['title'] + " " + head['keywords'] + " " + head['description']
+
+
+def resolve_canonical(url: str, head: dict[str, str | None], base: str | None = None) -> str:
+    """
+    页面通过<link rel=canonical>声明了同域名的规范链接时，以规范链接作为该页面的链接
+    :param url: 规范化后的页面链接，用于去重和保存
+    :param base: 重定向后实际访问的链接，相对的规范链接以它为基础补全，默认为url
+    """
+    if not head.get('canonical'):
+        return url
+    base = base or url
+    canonical = canonicalize(head['canonical'], base)
+    if canonical and ParserLink(canonical).netloc == ParserLink(base).netloc:
+        return canonical
+    return url
+
+
+def check_near_duplicate(index: SimHashIndex, href: str, head: dict[str, str | None],
+                         text: str) -> tuple[int, str | None]:
+    """
+    用title、keywords、description（simhash_body开启时再加上正文）计算SimHash，查找近似重复的页面
+    没有近似重复时把该页面加入索引，同一链接之前的指纹被替换
+    :return: (有符号的SimHash, 近似重复页面的链接或None)
+    """
+    content = head_text(head)
+    if simhash_body:
+        content += ' ' + extract_text(text, simhash_body_size)
+    fingerprint = simhash(content)
+    if fingerprint == 0:  # 没有可用的文本，不参与去重
+        return 0, None
+    return to_signed(fingerprint), index.add(fingerprint, href)
+
+
+def build_page_data(url: str, head: dict[str, str | None], lang: str, weight: float) -> list[dict[str, Any]]:
+    """
+    根据页面头部信息和语言检测结果计算语言权重
+    """
+    datas = []
+    title, keywords_content, description_content = head['title'], head['keywords'], head['description']
+    if lang == 'zh':
+        datas.append({
+            "title": title,
+            "keywords": keywords_content,
+            "description": description_content,
+            "href": url,
+            "weight": 0.5,
+            "netloc": ParserLink(url).netloc
+        })
+        return datas
+    datas.append({
+        "title": title,
+        "keywords": keywords_content,
+        "description": description_content,
+        "href": url,
+        "weight": weight if weight < 0.5 else 1 - weight,
+        "netloc": ParserLink(url).netloc
+    })
+    return datas
+
+
+def parse_page(url: str, text: str,
+               base: str | None = None) -> tuple[Union[list[dict[str, Any]], None], list[str]]:
+    """
+    页面处理：每个页面只下载一次，同时得到title、keywords、description、语言权重以及页面内的所有链接
+    头部信息用流式解析器读到</head>为止，链接单独用正则扫描一遍，都不构建完整的文档树
+    返回的数据中href为页面声明的规范链接（如果有），返回的链接未补全，需以base用expand_links()补全
+    :param base: 重定向后实际访问的链接，默认为url
+    """
     try:
-        response = requests.get(url, headers=_headers, timeout=4)
-        response.encoding = 'utf-8'
-        if response.status_code == 200:
-            soup = BeautifulSoup(response.text, 'html.parser')
-
-            keywords = soup.find('meta', attrs={"name": "keywords"})
-            description = soup.find('meta', attrs={"name": "description"})
-            title = soup.find('title')
-
-            title = title.text if title else None
-            keywords_content: str = keywords['content'] if keywords else ''
-            description_content: str = description['content'] if description else ''
-
-            if title in no_datas:
-                logger.info(f'{url} 的title为空')
-                return None
-
-            lang, weight = check_lang(title + " " + keywords_content + " " + description_content)
-            if lang == 'zh':
-                datas.append({
-                    "title": title,
-                    "keywords": keywords_content,
-                    "description": description_content,
-                    "href": url,
-                    "weight": 0.5,
-                    "netloc": ParserLink(url).netloc
-                })
-                return datas
-            datas.append({
-                "title": title,
-                "keywords": keywords_content,
-                "description": description_content,
-                "href": url,
-                "weight": weight if weight < 0.5 else 1 - weight,
-                "netloc": ParserLink(url).netloc
-            })
-            return datas
+        head = page_head(url, text)
+        if head is None:
+            return None, []
+        lang, weight = check_lang(head_text(head), ParserLink(url).netloc)
+        return build_page_data(resolve_canonical(url, head, base), head, lang, weight), extract_links(text)
     except Exception as e:
         logger.error(f"获取 {url} 信息出错：{e}")
-    return None
+    return None, []
 
 
-def get_links_from_url(url: str) -> list[str]:
+def fetch_page(url: str) -> tuple[str, str] | None:
+    """
+    :return: (重定向后实际访问的链接, 页面文本)
+    """
     if not url.startswith('http'):
-        return []
-    try:
-        response = requests.get(url, headers=_headers, timeout=4)
-        if response.status_code == 200:
-            soup = BeautifulSoup(response.text, 'html.parser')
-            links = [a['href'] for a in soup.find_all('a', href=True)]
-            return links
-    except Exception as e:
-        logger.error(f"访问 {url} 出错：{e}")
-    return []
+        return None
+    return fetch_document(url)
 
 
 def in_wiki(query: str) -> bool:
     try:
-        response = requests.get(wiki + '/wiki/' + query, headers=_headers, timeout=4)
+        response = fetch(wiki + '/wiki/' + query)
+        if response is None:
+            return False
         if '目前还没有与上述标题相同的条目' in response.text:
             return False
         return True
@@ -156,16 +164,73 @@ def in_wiki(query: str) -> bool:
         logger.error(f'检测维基百科收录出现错误{e}')
 
 
-def _save_bfs_state(queue: deque, file_name: str) -> None:
-    state_data = queue
-    try:
-        with open(f'./temp/{file_name}.pkl', 'wb') as f:
-            pickle.dump(state_data, f)
-    except Exception as e:
-        logger.error(f'保存pkl文件失败：{e}')
+def propagate_weight(data: list[dict[str, Any]], weight: float) -> list[dict[str, Any]]:
+    """
+    子链接根据父链接权重加权，是中文则增权更多，反之少
+    """
+    if data[0]['weight'] == 0.5:
+        data[0]['weight'] = (data[0]['weight'] + weight * 1.1) / 2
+    else:
+        data[0]['weight'] = (data[0]['weight'] + weight * 0.9) / 2
+    return data
+
+
+def expand_links(base: str, links: list[str], depth: int, weight: float) -> list[tuple[str, int, float | None]]:
+    """
+    将子链接以所在页面为基础补全并规范化，整理为队列项(链接, 深度, 父链接权重)
+    子链接不在此处抓取，等到出队时再获取其信息并根据父链接权重加权保存
+    :param base: 所在页面重定向后实际访问的链接，不是规范化后的链接，否则/docs/中的相对链接会被补全到/下
+    """
+    items = []
+    for link in links:
+        link = canonicalize(link, base)
+        if link is None or ParserLink(link).path.lower().endswith(_skip_extensions):  # 图片、压缩包等不是页面
+            continue
+        if 'wiki' in link and '.org' in link:  # 维基百科只入队不保存
+            items.append((link, depth + 1, None))
+        else:
+            items.append((link, depth + 1, weight))
+    return items
+
+
+def unpack_item(item: tuple) -> tuple[str, int, float | None]:
+    """
+    兼容旧版本保存的(链接, 深度)队列项
+    """
+    if len(item) == 2:
+        return item[0], item[1], None
+    return item
+
+
+def new_visited_filter(file_name: str) -> BloomFilter | ScalableBloomFilter:
+    """
+    每个爬虫队列使用自己的布隆过滤器文件，多个爬虫进程不会互相覆盖
+    """
+    if bloom_scalable:
+        return ScalableBloomFilter(bloom_dataSize, bloom_errorRate, file_name=f'bloom-{file_name}',
+                                   flush_interval=bloom_flushInterval)
+    return BloomFilter(bloom_dataSize, bloom_errorRate, file_name=f'bloom-{file_name}.bin',
+                       flush_interval=bloom_flushInterval)
+
+
+def new_governor(max_concurrency: int) -> ResourceGovernor:
+    return ResourceGovernor(
+        max_concurrency,
+        low_memory=governor_low_memory,
+        min_memory=governor_min_memory,
+        max_rss=governor_max_rss * 1024 ** 2,
+        max_sockets=governor_max_sockets,
+        interval=governor_interval,
+        enabled=spider_check_memory
+    )
 
 
 def _load_bfs_state(file_name: str) -> deque | None:
+    """
+    读取旧版本保存的pkl队列
+    """
+    if not os.path.exists(f'./temp/{file_name}.pkl'):
+        return None
     try:
         with open(f'./temp/{file_name}.pkl', 'rb') as f:
             queue = pickle.load(f)
@@ -176,61 +241,67 @@ def _load_bfs_state(file_name: str) -> deque | None:
         logger.error(f'加载queue状态时出错：{e}')
 
 
+def open_frontier(file_name: str, visited: BloomFilter | ScalableBloomFilter, seeds: list[str]) -> Frontier:
+    frontier = Frontier(file_name, visited)
+    if frontier.is_new():
+        queue = _load_bfs_state(file_name)
+        if queue:
+            logger.info(f'将{file_name}.pkl中的{len(queue)}个链接导入爬虫队列')
+            frontier.push_many([unpack_item(item) for item in queue])
+        elif seeds:
+            frontier.push_many([(canonicalize(seed) or seed, 0, None) for seed in seeds], dedupe=False)
+    return frontier
+
+
 def bfs(start: str, file_name, target_depth: int = 2) -> None:
-    visited = BloomFilter(bloom_dataSize, bloom_errorRate)
-    queue = _load_bfs_state(file_name) or deque([(start, 0)])
+    visited = new_visited_filter(file_name)
+    queue = open_frontier(file_name, visited, [start])
     robots_parser = RobotsParser(user_agent=engine_name_en)
-    with MongoDB(db_name, data_col_name) as db:
-        col = db.col
+    simhashes = SimHashIndex()
+    governor = new_governor(1).start()
+    get_lang_detector()  # 启动时加载语言检测模型
+    with get_storage().writer() as writer:
 
         while queue:
-            if spider_check_memory:
-                Schedule().schedule_interval(
-                    [
-                        {
-                            'function': Memory().canuse_memory_percentage,
-                            'seconds': 10
-                        }
-                    ], 0.1
-                )
-
-            url, depth = queue.popleft()
+            item = queue.pop()
+            if item is None:  # 剩下的链接所在域名都还在间隔时间内
+                time.sleep(queue.wait_time() or 0)
+                continue
+            url, depth, parent_weight = item
 
             if robots_parser.can_crawl(url):
-                if depth > target_depth:
+                if depth > target_depth + 1:  # 目标深度的下一层只保存信息，再往下则结束
                     break
-                if url in visited:
-                    continue
 
-                visited.add(url)
                 logger.info(f"深度：{depth}，链接：{url}，process：{multiprocessing.current_process().name}")
 
-                this_data = get_keywords_and_description(url)
-                if this_data is None:
-                    continue
-                weight = this_data[0]['weight'] if this_data[0]['weight'] >= 0.5 else 1 - this_data[0]['weight']  # 确保加权
-
-                links = get_links_from_url(url)
-                for link in links:
-                    if link.startswith('/'):
-                        link = start + link
-                    try:
-                        link = 'http' + link.split('http')[2]  # 获取到的链接存在一点问题，暂时用这个方法解决
-                    except IndexError:
-                        pass
-                    queue.append((link, depth + 1))
-                    if ('wiki' in link and '.org' in link) or (not link.startswith('http')):  # 去除维基百科和非链接
-                        continue
-                    data = get_keywords_and_description(link)
-                    if data is None:
-                        continue
-                    if data[0]['weight'] == 0.5:  # 增权，是中文则增权更多，反之少
-                        data[0]['weight'] = (data[0]['weight'] + weight * 1.1) / 2
-                    else:
-                        data[0]['weight'] = (data[0]['weight'] + weight * 0.9) / 2
-                    save_data(data, col)
-                _save_bfs_state(queue, file_name)
-                time.sleep(random.uniform(0.3, 0.9))
+                page = fetch_page(url)
+                if page is not None:
+                    base, text = page
+                    this_data, links = parse_page(url, text, base)
+                    if this_data is not None:
+                        weight = this_data[0]['weight'] if this_data[0]['weight'] >= 0.5 else 1 - this_data[0]['weight']  # 确保加权
+
+                        href = this_data[0]['href']
+                        if href != url and not visited.add_many([href])[0]:
+                            logger.info(f'{url} 的规范链接 {href} 已抓取过')
+                        else:
+                            fingerprint, duplicate = check_near_duplicate(simhashes, href, this_data[0], text)
+                            if duplicate is not None:  # 镜像、模板页等近似重复的页面不保存，也不再抓取其子链接
+                                logger.info(f'{href} 与 {duplicate} 近似重复')
+                            else:
+                                this_data[0]['simhash'] = fingerprint
+                                if parent_weight is not None:
+                                    writer.add(propagate_weight(this_data, parent_weight))
+                                if depth <= target_depth:
+                                    queue.push_many(expand_links(base, links, depth, weight))
+                queue.done(url)
+                time.sleep(random.uniform(0.3, 0.9) * (1 + 4 * governor.pressure))  # 资源紧张时放慢抓取
             else:
                 logger.warning(f'{url}不允许爬')
+                queue.done(url)
                 continue
+    governor.stop()
+    queue.close()
+    visited.flush()
+    simhashes.close()
@@ -0,0 +1,624 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Iterable, Iterator
+
+from pymongo import ASCENDING, DeleteOne, UpdateOne
+from pymongo.collection import Collection
+
+from config import (
+    db_name,
+    data_col_name,
+    key_col_name,
+    terms_col_name,
+    meta_col_name,
+    storage_backend,
+    storage_file,
+    doc_cache_size,
+    doc_cache_ttl,
+)
+from database import get_client, get_async_client
+from mongodb import BulkWriter, ensure_unique_index, del_repeat, search_data, find_all, creat_index, search_key
+
+
+class Storage(ABC):
+    """
+    存储接口
+    爬虫、索引构建器、任务管理器和后端服务只通过这里读写数据，具体使用哪种存储由config.storage_backend决定。
+    页面以href为主键，写入和更新时记录时间戳updated，索引构建器据此只处理变化过的页面；
+    反向索引每个关键词一条记录，保存包含该关键词的文档编号（doc_id），以postings.encode_postings()压缩为二进制。
+    新的存储需实现所有抽象方法，否则创建时就会报错。
+    """
+
+    @abstractmethod
+    def writer(self) -> BulkWriter:
+        """
+        :return: 以href为主键批量写入页面的写入器，用法为 with storage.writer() as writer
+        """
+        raise NotImplementedError
+
+    def save_pages(self, datas: list[dict[str, Any]]) -> None:
+        with self.writer() as writer:
+            writer.add(datas)
+
+    @abstractmethod
+    def find_pages(self, fields: list[str] | None = None) -> Iterator[dict[str, Any]]:
+        """
+        :param fields: 需要的字段，None为全部字段
+        :return: 按写入顺序遍历所有页面
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def find_pages_by_ids(self, doc_ids: list[int], fields: list[str] | None = None) -> list[dict[str, Any]]:
+        """
+        按文档编号批量查询，只读取这些页面
+        :return: 文档编号对应的页面，按doc_ids的顺序，不存在的编号跳过
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def search_pages(self, text: str) -> list[dict[str, Any]]:
+        """
+        :return: title、keywords或description中包含text（不区分大小写）的页面，按权重降序
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def update_page(self, href: str, fields: dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def inc_weight(self, href: str, value: float) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def netloc_weights(self, netloc: str) -> list[float]:
+        """
+        :return: 该域名下所有页面的权重
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def dedup(self) -> None:
+        """
+        按href去重
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def find_changed_pages(self, since: float, fields: list[str] | None = None) -> Iterator[dict[str, Any]]:
+        """
+        :return: 时间戳updated大于since（写入或更新时记录）的页面
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_doc_ids(self, doc_ids: dict[str, int]) -> None:
+        """
+        :param doc_ids: {href: 文档编号}，编号由索引构建器分配，之后不再改变
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_postings(self, keys: list[str]) -> dict[str, bytes]:
+        """
+        :return: {关键词: postings.encode_postings()压缩的倒排记录}，不存在的关键词不返回
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def save_postings(self, postings: dict[str, bytes]) -> None:
+        """
+        覆盖写入关键词的倒排记录，每个关键词一条，值为b''时删除该关键词
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def iter_postings(self) -> Iterator[tuple[str, bytes]]:
+        """
+        :return: 按关键词的UTF-8字节序遍历全部倒排记录
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_doc_terms(self, doc_ids: list[int]) -> dict[int, dict[str, Any]]:
+        """
+        :return: {文档编号: 上次索引时该文档的记录}，记录为{'terms': [[关键词, 各字段词频...]], 'lengths': [各字段长度]}
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def save_doc_terms(self, records: dict[int, dict[str, Any]]) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_meta(self, key: str, default: Any = None) -> Any:
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_meta(self, key: str, value: Any) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def clear_index(self) -> None:
+        """
+        删除反向索引和文档关键词，已分配的文档编号保留
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def search_key(self, key: str) -> bytes | None:
+        """
+        :return: 该关键词压缩的倒排记录，用postings.decode_postings()解码，没有时返回None
+        """
+        raise NotImplementedError
+
+    def create_indexes(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    # 异步接口默认在线程中执行同步接口，支持异步驱动的存储可以重写
+    async def afind_pages(self, fields: list[str] | None = None) -> list[dict[str, Any]]:
+        return await asyncio.to_thread(lambda: list(self.find_pages(fields)))
+
+    async def afind_pages_by_ids(self, doc_ids: list[int], fields: list[str] | None = None) -> list[dict[str, Any]]:
+        return await asyncio.to_thread(self.find_pages_by_ids, doc_ids, fields)
+
+    async def asearch_pages(self, text: str) -> list[dict[str, Any]]:
+        return await asyncio.to_thread(self.search_pages, text)
+
+    async def asearch_key(self, key: str) -> bytes | None:
+        return await asyncio.to_thread(self.search_key, key)
+
+
+_chunk_size = 1000  # 按关键词或编号批量查询、写入时每批的数量
+
+
+def _touch(datas: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    now = time.time()
+    return [{**data, 'updated': now} for data in datas]
+
+
+def _chunks(items: list, size: int = _chunk_size) -> Iterator[list]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _with_doc_id(fields: list[str] | None) -> list[str] | None:
+    return None if fields is None else [*fields, 'doc_id']
+
+
+def _in_order(datas: Iterable[dict[str, Any]], doc_ids: list[int], fields: list[str] | None) -> list[dict[str, Any]]:
+    """
+    按doc_ids的顺序排列按_with_doc_id(fields)查询到的页面，fields中没有doc_id时去掉该字段
+    """
+    found = {data['doc_id']: data for data in datas}
+    datas = [found[doc_id] for doc_id in doc_ids if doc_id in found]
+    if fields is not None and 'doc_id' not in fields:
+        for data in datas:
+            del data['doc_id']
+    return datas
+
+
+def _projection(fields: list[str] | None) -> dict[str, int]:
+    if fields is None:
+        return {'_id': 0}
+    return {'_id': 0, **{field: 1 for field in fields}}
+
+
+class _MongoWriter(BulkWriter):
+    def _write(self, datas: list[dict]) -> None:
+        super()._write(_touch(datas))
+
+
+class MongoStorage(Storage):
+    """
+    MongoDB存储，使用database中进程内共用的客户端
+    """
+
+    @staticmethod
+    def _col(col_name: str = data_col_name) -> Collection:
+        return get_client()[db_name][col_name]
+
+    @staticmethod
+    def _async_col(col_name: str = data_col_name) -> Any:
+        return get_async_client()[db_name][col_name]
+
+    def writer(self) -> BulkWriter:
+        return _MongoWriter(self._col())
+
+    def find_pages(self, fields: list[str] | None = None) -> Iterator[dict[str, Any]]:
+        return iter(find_all(self._col(), _projection(fields)))
+
+    def find_pages_by_ids(self, doc_ids: list[int], fields: list[str] | None = None) -> list[dict[str, Any]]:
+        datas = [data for chunk in _chunks(doc_ids)
+                 for data in self._col().find({'doc_id': {'$in': chunk}}, projection=_projection(_with_doc_id(fields)))]
+        return _in_order(datas, doc_ids, fields)
+
+    def search_pages(self, text: str) -> list[dict[str, Any]]:
+        return list(search_data(text, self._col()))
+
+    def update_page(self, href: str, fields: dict[str, Any]) -> None:
+        self._col().update_one({'href': href}, {'$set': _touch([fields])[0]})
+
+    def inc_weight(self, href: str, value: float) -> None:
+        self._col().update_many({'href': href}, {'$inc': {'weight': value}})
+
+    def netloc_weights(self, netloc: str) -> list[float]:
+        return [data['weight'] for data in self._col().find({'netloc': netloc}, projection={'_id': 0, 'weight': 1})]
+
+    def dedup(self) -> None:
+        del_repeat(self._col(), 'href', data_col_name)
+
+    def find_changed_pages(self, since: float, fields: list[str] | None = None) -> Iterator[dict[str, Any]]:
+        return iter(self._col().find({'updated': {'$gt': since}}, projection=_projection(fields)))
+
+    def set_doc_ids(self, doc_ids: dict[str, int]) -> None:
+        for chunk in _chunks(list(doc_ids.items())):
+            self._col().bulk_write([UpdateOne({'href': href}, {'$set': {'doc_id': doc_id}})
+                                    for href, doc_id in chunk], ordered=False)
+
+    def get_postings(self, keys: list[str]) -> dict[str, bytes]:
+        postings = {}
+        for chunk in _chunks(keys):
+            for data in self._col(key_col_name).find({'key': {'$in': chunk}}, projection={'_id': 0}):
+                postings[data['key']] = bytes(data['value'])
+        return postings
+
+    def save_postings(self, postings: dict[str, bytes]) -> None:
+        for chunk in _chunks(list(postings.items())):
+            self._col(key_col_name).bulk_write(
+                [UpdateOne({'key': key}, {'$set': {'value': value}}, upsert=True) if value else DeleteOne({'key': key})
+                 for key, value in chunk], ordered=False
+            )
+
+    def iter_postings(self) -> Iterator[tuple[str, bytes]]:
+        for data in self._col(key_col_name).find(projection={'_id': 0}).sort('key', ASCENDING):
+            yield data['key'], bytes(data['value'])
+
+    def get_doc_terms(self, doc_ids: list[int]) -> dict[int, dict[str, Any]]:
+        records = {}
+        for chunk in _chunks(doc_ids):
+            for data in self._col(terms_col_name).find({'doc_id': {'$in': chunk}}, projection={'_id': 0}):
+                records[data.pop('doc_id')] = data
+        return records
+
+    def save_doc_terms(self, records: dict[int, dict[str, Any]]) -> None:
+        for chunk in _chunks(list(records.items())):
+            self._col(terms_col_name).bulk_write([UpdateOne({'doc_id': doc_id}, {'$set': record}, upsert=True)
+                                                  for doc_id, record in chunk], ordered=False)
+
+    def get_meta(self, key: str, default: Any = None) -> Any:
+        data = self._col(meta_col_name).find_one({'key': key})
+        return default if data is None else data['value']
+
+    def set_meta(self, key: str, value: Any) -> None:
+        self._col(meta_col_name).update_one({'key': key}, {'$set': {'value': value}}, upsert=True)
+
+    def clear_index(self) -> None:
+        for col_name in (key_col_name, terms_col_name):
+            self._col(col_name).drop()
+        self._col(key_col_name).create_index([('key', ASCENDING)], unique=True)
+        self._col(terms_col_name).create_index([('doc_id', ASCENDING)], unique=True)
+        self._col(meta_col_name).create_index([('key', ASCENDING)], unique=True)
+
+    def search_key(self, key: str) -> bytes | None:
+        data = next(search_key(key, self._col(key_col_name)), None)
+        return None if data is None else bytes(data['value'])
+
+    def create_indexes(self) -> None:
+        col = self._col()
+        creat_index(col)
+        ensure_unique_index(col, 'href')
+        col.create_index([('updated', ASCENDING)])
+        col.create_index([('doc_id', ASCENDING)], unique=True, sparse=True)
+
+    async def afind_pages(self, fields: list[str] | None = None) -> list[dict[str, Any]]:
+        return await find_all(self._async_col(), _projection(fields)).to_list(None)
+
+    async def afind_pages_by_ids(self, doc_ids: list[int], fields: list[str] | None = None) -> list[dict[str, Any]]:
+        datas = []
+        for chunk in _chunks(doc_ids):
+            datas += await self._async_col().find({'doc_id': {'$in': chunk}},
+                                                  projection=_projection(_with_doc_id(fields))).to_list(None)
+        return _in_order(datas, doc_ids, fields)
+
+    async def asearch_pages(self, text: str) -> list[dict[str, Any]]:
+        return await search_data(text, self._async_col()).to_list(None)
+
+    async def asearch_key(self, key: str) -> bytes | None:
+        datas = await search_key(key, self._async_col(key_col_name)).to_list(1)
+        return bytes(datas[0]['value']) if datas else None
+
+
+class _SQLiteWriter(BulkWriter):
+    """
+    col为SQLiteStorage
+    """
+
+    def _prepare(self) -> None:
+        pass
+
+    def _write(self, datas: list[dict]) -> None:
+        self.col.upsert_pages(_touch(datas), self.insert_only)
+
+
+class SQLiteStorage(Storage):
+    """
+    嵌入式存储，单机部署时不需要另外运行mongod
+    数据保存在./temp/{file_name}（SQLite，WAL模式），多个进程可以同时读写。
+    title、keywords、description、weight、netloc、doc_id、updated单独成列，其余字段以JSON保存在extra列中。
+    """
+
+    _columns = ('title', 'keywords', 'description', 'weight', 'netloc', 'doc_id', 'updated')
+    _optional = ('doc_id', 'updated')  # 为空时不出现在返回的页面中
+
+    def __init__(self, file_name: str = storage_file):
+        os.makedirs('./temp', exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(f'./temp/{file_name}', check_same_thread=False, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS pages (href TEXT PRIMARY KEY, title TEXT, keywords TEXT, description TEXT, '
+            "weight REAL NOT NULL DEFAULT 0, netloc TEXT, extra TEXT NOT NULL DEFAULT '{}', doc_id INTEGER, updated REAL)"
+        )
+        self._migrate()
+        self._conn.execute('CREATE INDEX IF NOT EXISTS pages_netloc ON pages (netloc)')
+        self._conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS pages_doc_id ON pages (doc_id)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS pages_updated ON pages (updated)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS keys (key TEXT PRIMARY KEY, value BLOB NOT NULL)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS doc_terms '
+                           '(doc_id INTEGER PRIMARY KEY, terms TEXT NOT NULL, lengths TEXT NOT NULL)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+        self._conn.commit()
+
+    def _migrate(self) -> None:
+        """
+        旧版本的pages表没有doc_id和updated列；keys表每个关键词有多条记录，保存的是按位置编号的页面，直接删除；
+        doc_terms表没有词频和字段长度，直接删除，索引构建器发现倒排记录格式变化后会重建
+        """
+        columns = [row[1] for row in self._conn.execute('PRAGMA table_info(pages)')]
+        if 'doc_id' not in columns:
+            self._conn.execute('ALTER TABLE pages ADD COLUMN doc_id INTEGER')
+            self._conn.execute('ALTER TABLE pages ADD COLUMN updated REAL')
+        if any(row[1] == 'key' and not row[5] for row in self._conn.execute('PRAGMA table_info(keys)')):
+            self._conn.execute('DROP TABLE keys')
+        columns = [row[1] for row in self._conn.execute('PRAGMA table_info(doc_terms)')]
+        if columns and 'lengths' not in columns:
+            self._conn.execute('DROP TABLE doc_terms')
+
+    def _to_dict(self, row: sqlite3.Row, fields: list[str] | None) -> dict[str, Any]:
+        data = {'href': row['href'], **{column: row[column] for column in self._columns
+                                        if column not in self._optional or row[column] is not None},
+                **json.loads(row['extra'])}
+        if fields is None:
+            return data
+        return {field: data[field] for field in fields if field in data}
+
+    def upsert_pages(self, datas: list[dict[str, Any]], insert_only: tuple[str, ...] = ()) -> None:
+        """
+        以href为主键写入，已存在的页面只更新传入的字段
+        :param insert_only: 只在插入新页面时写入的列，已存在的页面保留原值
+        """
+        with self._lock:
+            for data in datas:
+                row = self._conn.execute('SELECT extra FROM pages WHERE href = ?', (data['href'],)).fetchone()
+                extra = json.loads(row['extra']) if row else {}
+                extra.update({key: value for key, value in data.items()
+                              if key != 'href' and key not in self._columns})
+                columns = [column for column in self._columns if column in data] + ['extra']
+                updates = [column for column in columns if column not in insert_only]
+                self._conn.execute(
+                    f'INSERT INTO pages (href, {", ".join(columns)}) VALUES (?{", ?" * len(columns)}) '
+                    f'ON CONFLICT (href) DO UPDATE SET {", ".join(f"{column} = excluded.{column}" for column in updates)}',
+                    (data['href'], *[data[column] for column in columns[:-1]], json.dumps(extra, ensure_ascii=False))
+                )
+            self._conn.commit()
+
+    def writer(self) -> BulkWriter:
+        return _SQLiteWriter(self)
+
+    def _iter_pages(self, fields: list[str] | None, where: str = '', params: tuple = ()) -> Iterator[dict[str, Any]]:
+        """
+        按rowid分批读取页面，每批单独查询，不会一次读出整张表；遍历期间不占用连接，可以同时写入
+        """
+        last = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(f'SELECT rowid, * FROM pages WHERE rowid > ? {where} ORDER BY rowid LIMIT ?',
+                                          (last, *params, _chunk_size)).fetchall()
+            yield from (self._to_dict(row, fields) for row in rows)
+            if len(rows) < _chunk_size:
+                return
+            last = rows[-1]['rowid']
+
+    def find_pages(self, fields: list[str] | None = None) -> Iterator[dict[str, Any]]:
+        return self._iter_pages(fields)
+
+    def find_pages_by_ids(self, doc_ids: list[int], fields: list[str] | None = None) -> list[dict[str, Any]]:
+        rows = []
+        with self._lock:
+            for chunk in _chunks(doc_ids):
+                rows += self._conn.execute(f'SELECT * FROM pages WHERE doc_id IN ({", ".join("?" * len(chunk))})',
+                                           chunk).fetchall()
+        return _in_order((self._to_dict(row, _with_doc_id(fields)) for row in rows), doc_ids, fields)
+
+    def search_pages(self, text: str) -> list[dict[str, Any]]:
+        pattern = '%' + text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM pages WHERE keywords LIKE ? ESCAPE '\\' OR description LIKE ? ESCAPE '\\' "
+                "OR title LIKE ? ESCAPE '\\' ORDER BY weight DESC", (pattern, pattern, pattern)
+            ).fetchall()
+        return [self._to_dict(row, None) for row in rows]
+
+    def update_page(self, href: str, fields: dict[str, Any]) -> None:
+        with self._lock:
+            exists = self._conn.execute('SELECT 1 FROM pages WHERE href = ?', (href,)).fetchone()
+        if exists:
+            self.upsert_pages(_touch([{**fields, 'href': href}]))
+
+    def inc_weight(self, href: str, value: float) -> None:
+        with self._lock:
+            self._conn.execute('UPDATE pages SET weight = weight + ? WHERE href = ?', (value, href))
+            self._conn.commit()
+
+    def netloc_weights(self, netloc: str) -> list[float]:
+        with self._lock:
+            return [row[0] for row in self._conn.execute('SELECT weight FROM pages WHERE netloc = ?', (netloc,))]
+
+    def dedup(self) -> None:
+        pass  # href为主键，不会有重复的页面
+
+    def find_changed_pages(self, since: float, fields: list[str] | None = None) -> Iterator[dict[str, Any]]:
+        return self._iter_pages(fields, 'AND updated > ?', (since,))
+
+    def set_doc_ids(self, doc_ids: dict[str, int]) -> None:
+        with self._lock:
+            self._conn.executemany('UPDATE pages SET doc_id = ? WHERE href = ?',
+                                   [(doc_id, href) for href, doc_id in doc_ids.items()])
+            self._conn.commit()
+
+    def get_postings(self, keys: list[str]) -> dict[str, bytes]:
+        postings = {}
+        with self._lock:
+            for chunk in _chunks(keys):
+                for key, value in self._conn.execute(
+                        f'SELECT key, value FROM keys WHERE key IN ({", ".join("?" * len(chunk))})', chunk):
+                    postings[key] = value
+        return postings
+
+    def save_postings(self, postings: dict[str, bytes]) -> None:
+        with self._lock:
+            self._conn.executemany('INSERT OR REPLACE INTO keys (key, value) VALUES (?, ?)',
+                                   [(key, value) for key, value in postings.items() if value])
+            self._conn.executemany('DELETE FROM keys WHERE key = ?', [(key,) for key, value in postings.items()
+                                                                      if not value])
+            self._conn.commit()
+
+    def iter_postings(self) -> Iterator[tuple[str, bytes]]:
+        with self._lock:
+            rows = self._conn.execute('SELECT key, value FROM keys ORDER BY key').fetchall()
+        return ((key, value) for key, value in rows)
+
+    def get_doc_terms(self, doc_ids: list[int]) -> dict[int, dict[str, Any]]:
+        records = {}
+        with self._lock:
+            for chunk in _chunks(doc_ids):
+                for doc_id, terms, lengths in self._conn.execute(
+                        f'SELECT doc_id, terms, lengths FROM doc_terms WHERE doc_id IN ({", ".join("?" * len(chunk))})',
+                        chunk):
+                    records[doc_id] = {'terms': json.loads(terms), 'lengths': json.loads(lengths)}
+        return records
+
+    def save_doc_terms(self, records: dict[int, dict[str, Any]]) -> None:
+        with self._lock:
+            self._conn.executemany('INSERT OR REPLACE INTO doc_terms (doc_id, terms, lengths) VALUES (?, ?, ?)',
+                                   [(doc_id, json.dumps(record['terms'], ensure_ascii=False),
+                                     json.dumps(record['lengths'])) for doc_id, record in records.items()])
+            self._conn.commit()
+
+    def get_meta(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            row = self._conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return default if row is None else json.loads(row[0])
+
+    def set_meta(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, json.dumps(value)))
+            self._conn.commit()
+
+    def clear_index(self) -> None:
+        with self._lock:
+            for table in ('keys', 'doc_terms'):
+                self._conn.execute(f'DELETE FROM {table}')
+            self._conn.commit()
+
+    def search_key(self, key: str) -> bytes | None:
+        with self._lock:
+            row = self._conn.execute('SELECT value FROM keys WHERE key = ?', (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_storage: Storage | None = None
+_storage_pid: int | None = None
+_storage_lock = threading.Lock()
+
+
+def get_storage() -> Storage:
+    """
+    进程内共用的存储，fork出的子进程首次调用时重新创建
+    """
+    global _storage, _storage_pid
+    if _storage is not None and _storage_pid == os.getpid():
+        return _storage
+    with _storage_lock:
+        if _storage is None or _storage_pid != os.getpid():
+            if storage_backend == 'mongodb':
+                _storage = MongoStorage()
+            elif storage_backend == 'sqlite':
+                _storage = SQLiteStorage()
+            else:
+                raise ValueError(f'不支持的存储：{storage_backend}')
+            _storage_pid = os.getpid()
+    return _storage
+
+
+class DocumentCache:
+    """
+    后端服务按文档编号缓存最近查询过的页面（LRU），最多保留size个，超过ttl秒的页面重新读取
+    source为页面的来源（如索引段的文件名），来源变化时清空缓存；取出的是副本，调用方可以修改
+    """
+
+    def __init__(self, size: int = doc_cache_size, ttl: float = doc_cache_ttl):
+        self.size = size
+        self.ttl = ttl
+        self._cache: OrderedDict[int, tuple[dict[str, Any], float]] = OrderedDict()
+        self._source: Any = None
+        self._lock = threading.Lock()
+
+    def get(self, doc_ids: list[int], source: Any = None) -> tuple[dict[int, dict[str, Any]], list[int]]:
+        """
+        :return: 缓存中的页面{文档编号: 页面}，不在缓存中或已过期的文档编号
+        """
+        found, missing = {}, []
+        now = time.monotonic()
+        with self._lock:
+            if source != self._source:
+                self._cache.clear()
+                self._source = source
+            for doc_id in doc_ids:
+                cached = self._cache.get(doc_id)
+                if cached and cached[1] > now:
+                    self._cache.move_to_end(doc_id)
+                    found[doc_id] = dict(cached[0])
+                else:
+                    missing.append(doc_id)
+        return found, missing
+
+    def put(self, datas: list[dict[str, Any]], source: Any = None) -> None:
+        if self.size <= 0:
+            return
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            if source != self._source:
+                return
+            for data in datas:
+                self._cache[data['doc_id']] = (dict(data), expires)
+                self._cache.move_to_end(data['doc_id'])
+            while len(self._cache) > self.size:
+                self._cache.popitem(last=False)
@@ -0,0 +1,149 @@
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import numpy as np
+
+from canonical import canonicalize
+from postings import PostingList, encode_postings, intersect_postings, union_postings
+from robots import RobotsParser, RobotsRules
+from simhash import SimHashIndex, simhash
+
+
+class SimHashIndexTest(unittest.TestCase):
+    text = '天眼搜索引擎 爬虫 反向索引 search engine crawler inverted index'
+
+    def setUp(self):
+        self.index = SimHashIndex(file_name=None)
+
+    def tearDown(self):
+        self.index.close()
+
+    def test_duplicate(self):
+        fingerprint = simhash(self.text)
+        self.assertIsNone(self.index.add(fingerprint, 'http://a.com/'))
+        self.assertEqual(self.index.add(fingerprint, 'http://b.com/'), 'http://a.com/')
+
+    def test_readd_same_href(self):
+        fingerprint = simhash(self.text)
+        self.assertIsNone(self.index.add(fingerprint, 'http://a.com/'))
+        self.assertIsNone(self.index.add(fingerprint, 'http://a.com/'))
+        changed = simhash('全新的内容 completely different content')
+        self.assertIsNone(self.index.add(changed, 'http://a.com/'))
+        self.assertIsNone(self.index.find(fingerprint))
+        self.assertEqual(self.index.find(changed, 'http://b.com/'), 'http://a.com/')
+        self.assertEqual(self.index._conn.execute('SELECT COUNT(*) FROM simhash').fetchone()[0],
+                         self.index._bands)
+
+
+class CanonicalizeTest(unittest.TestCase):
+    def test_normalize(self):
+        self.assertEqual(canonicalize('HTTP://Example.COM:80/a/./b/../c?utm_source=x#top'), 'http://example.com/a/c')
+        self.assertEqual(canonicalize('page.html?b=2&a=1', 'https://example.com/docs/'),
+                         'https://example.com/docs/page.html?a=1&b=2')
+        self.assertIsNone(canonicalize('mailto:someone@example.com'))
+
+    def test_query_not_decoded(self):
+        self.assertEqual(canonicalize('http://a.com/s?q=c%2B%2B'), 'http://a.com/s?q=c%2B%2B')
+        self.assertEqual(canonicalize('http://a.com/s?q=a+b'), 'http://a.com/s?q=a+b')
+        self.assertEqual(canonicalize('http://a.com/s?q=100%25'), 'http://a.com/s?q=100%25')
+        self.assertEqual(canonicalize('http://a.com/s?q=%2541'), 'http://a.com/s?q=%2541')
+        self.assertEqual(canonicalize('http://a.com/s?a'), 'http://a.com/s?a')
+
+    def test_query_order_and_encoding(self):
+        self.assertEqual(canonicalize('http://a.com/s?b=2&a=1&a=0'), 'http://a.com/s?a=1&a=0&b=2')
+        self.assertEqual(canonicalize('http://a.com/s?x=%e4%b8%ad&y=%7E'), 'http://a.com/s?x=%E4%B8%AD&y=~')
+        self.assertEqual(canonicalize('http://a.com/s?q=100%'), 'http://a.com/s?q=100%25')
+
+
+class RobotsRulesTest(unittest.TestCase):
+    robots_txt = '''
+User-agent: *
+Disallow: /private
+
+User-agent: spider
+User-agent:
+Disallow: /
+
+User-agent: ty
+Disallow: /ty-only
+
+User-agent: TY-Spider/2.0
+Allow: /private/open
+Disallow: /admin
+Crawl-delay: 2
+'''
+
+    def test_group_selection(self):
+        rules = RobotsRules.parse(self.robots_txt, 'TY-Spider')
+        self.assertTrue(rules.can_fetch('/index.html'))
+        self.assertTrue(rules.can_fetch('/private'))
+        self.assertTrue(rules.can_fetch('/ty-only'))
+        self.assertFalse(rules.can_fetch('/admin/users'))
+        self.assertEqual(rules.crawl_delay, 2)
+
+    def test_fallback(self):
+        rules = RobotsRules.parse(self.robots_txt, 'TY')
+        self.assertFalse(rules.can_fetch('/ty-only'))
+        self.assertTrue(rules.can_fetch('/private'))
+        rules = RobotsRules.parse(self.robots_txt, 'OtherBot')
+        self.assertFalse(rules.can_fetch('/private/open'))
+        self.assertTrue(rules.can_fetch('/index.html'))
+
+    def test_longest_match(self):
+        rules = RobotsRules(allow=['/a/b', '/p$', '/*.html$'], disallow=['/a', '/p', '/x/*.html'])
+        self.assertFalse(rules.can_fetch('/a/c'))
+        self.assertTrue(rules.can_fetch('/a/b/c'))
+        self.assertTrue(rules.can_fetch('/p'))
+        self.assertFalse(rules.can_fetch('/page'))
+        self.assertFalse(rules.can_fetch('/x/y.html'))
+        self.assertTrue(rules.can_fetch('/y.html'))
+        self.assertTrue(RobotsRules(allow=['/a'], disallow=['/a']).can_fetch('/a'))
+
+    def test_server_error(self):
+        parser = RobotsParser(file_name=None)
+        with mock.patch('robots.fetch', return_value=SimpleNamespace(status_code=503, text='')):
+            self.assertFalse(parser.can_crawl('http://a.com/page'))
+        with mock.patch('robots.fetch', return_value=SimpleNamespace(status_code=404, text='')):
+            self.assertTrue(parser.can_crawl('http://b.com/page'))
+
+
+class PostingsTest(unittest.TestCase):
+    block_size = 128
+
+    def test_round_trip(self):
+        rng = np.random.default_rng(0)
+        for count in (0, 1, 127, 128, 129, 256, 1000):
+            doc_ids = np.sort(rng.choice(2 ** 40, count, replace=False))
+            freqs = rng.integers(0, 300, (count, 3))
+            posting_list = PostingList(encode_postings(doc_ids, freqs, self.block_size))
+            self.assertEqual(len(posting_list), count)
+            np.testing.assert_array_equal(posting_list.decode(), doc_ids)
+            np.testing.assert_array_equal(posting_list.freqs(), np.minimum(freqs, 255))
+            if count:
+                blocks = [posting_list.block(i) for i in range(len(posting_list.firsts))]
+                np.testing.assert_array_equal(np.concatenate(blocks), doc_ids)
+
+    def test_filter(self):
+        doc_ids = np.arange(0, 3000, 3)
+        posting_list = PostingList(encode_postings(doc_ids, block_size=self.block_size))
+        targets = np.array([0, 1, 381, 384, 385, 387, 2997, 3000])
+        np.testing.assert_array_equal(posting_list.filter(targets), [0, 381, 384, 387, 2997])
+        self.assertEqual(len(posting_list.filter(np.array([-5, 5000]))), 0)
+        self.assertEqual(len(PostingList(encode_postings([])).filter(targets)), 0)
+
+    def test_intersect_union(self):
+        a = np.arange(0, 2000, 2)
+        b = np.arange(0, 2000, 3)
+        c = np.array([6, 383, 384, 1998])
+        datas = [encode_postings(ids, block_size=self.block_size) for ids in (a, b, c)]
+        np.testing.assert_array_equal(intersect_postings(*datas[:2]), np.arange(0, 2000, 6))
+        np.testing.assert_array_equal(intersect_postings(*datas), [6, 384, 1998])
+        np.testing.assert_array_equal(union_postings(*datas), np.union1d(np.union1d(a, b), c))
+        self.assertEqual(len(intersect_postings(datas[0], encode_postings([1, 3, 5]))), 0)
+        self.assertEqual(len(intersect_postings()), 0)
+        self.assertEqual(len(union_postings()), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
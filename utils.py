@@ -1,10 +1,15 @@
-import copy
+import asyncio
+import atexit
 import ctypes
 import math
-import pickle
+import mmap
+import os
+import struct
 import sys
+import threading
 import time
-from collections import defaultdict
+import zlib
+from collections import defaultdict, OrderedDict
 from dataclasses import dataclass
 from datetime import date
 from time import perf_counter
@@ -26,7 +31,13 @@ try:
 except ImportError:
     raise ImportError('Requires mmh3')
 
-_lang_model = None  # 全局变量，以免重复加载模型
+try:
+    import numpy as np
+except ImportError:
+    raise ImportError('Requires numpy')
+
+_lang_detector = None  # 全局变量，以免重复加载模型
+_UINT64_MASK = (1 << 64) - 1
 
 
 @dataclass
@@ -51,19 +62,153 @@ def is_url(query: str) -> bool:
     return False
 
 
-def check_lang(s: str) -> tuple[str, float]:
-    global _lang_model
-    if not _lang_model:
+class LangDetector:
+    """
+    语言检测
+    创建时即加载模型，每个进程只加载一次；predict_many()把多段文本一次交给fastText预测。
+    结果按规范化文本（去掉多余空白并转为小写）的哈希缓存；
+    同一域名连续stable_count次检测出相同语言且置信度不低于stable_confidence后，
+    视为该域名语言稳定，之后该域名的页面直接使用缓存结果，不再预测。
+    """
+
+    def __init__(self, model_path: str = 'lid.176.ftz', cache_size: int = 100000,
+                 stable_count: int = 5, stable_confidence: float = 0.9):
         import fasttext
         try:
             fasttext.FastText.eprint = lambda *args, **kwargs: None
         except Exception:
             pass
-        _lang_model = fasttext.load_model('lid.176.ftz')
-    res = _lang_model.predict(s.replace('\n', ''))
-    lang = res[0][0][9:]
-    like = res[1][0]
-    return str(lang), float(like)
+        self._model = fasttext.load_model(model_path)
+        self._cache: OrderedDict[bytes, tuple[str, float]] = OrderedDict()
+        self._cache_size = cache_size
+        self._stable_count = stable_count
+        self._stable_confidence = stable_confidence
+        self._hosts: dict[str, tuple[str, float, int]] = {}  # 域名 -> (语言, 平均置信度, 连续次数)
+
+    @staticmethod
+    def _normalize(text: str) -> str:
+        return ' '.join(text.split()).lower()
+
+    def _remember(self, netloc: str | None, lang: str, like: float) -> None:
+        if not netloc:
+            return
+        host = self._hosts.get(netloc)
+        if host is None or host[0] != lang or like < self._stable_confidence:
+            self._hosts[netloc] = (lang, like, 1 if like >= self._stable_confidence else 0)
+        elif host[2] < self._stable_count:
+            self._hosts[netloc] = (lang, (host[1] * host[2] + like) / (host[2] + 1), host[2] + 1)
+
+    def host_lang(self, netloc: str | None) -> tuple[str, float] | None:
+        """
+        :return: 语言已稳定的域名的(语言, 平均置信度)，否则返回None
+        """
+        host = self._hosts.get(netloc) if netloc else None
+        if host is not None and host[2] >= self._stable_count:
+            return host[0], host[1]
+        return None
+
+    def predict_many(self, texts: list[str], netlocs: list[str | None] | None = None) -> list[tuple[str, float]]:
+        """
+        :param texts: 需要检测的文本
+        :param netlocs: 文本所属的域名，用于按域名缓存，可为None
+        :return: 与texts等长的(语言, 置信度)列表
+        """
+        netlocs = netlocs or [None] * len(texts)
+        results: list[tuple[str, float] | None] = [None] * len(texts)
+        missing: dict[bytes, list[int]] = {}
+        missing_texts: list[str] = []
+
+        for i, (text, netloc) in enumerate(zip(texts, netlocs)):
+            host = self.host_lang(netloc)
+            if host is not None:
+                results[i] = host
+                continue
+            normalized = self._normalize(text)
+            key = mmh3.hash_bytes(normalized)
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                results[i] = self._cache[key]
+            elif key in missing:
+                missing[key].append(i)
+            else:
+                missing[key] = [i]
+                missing_texts.append(normalized)
+
+        if missing_texts:
+            labels, likes = self._model.predict(missing_texts)
+            for (key, positions), label, like in zip(missing.items(), labels, likes):
+                result = (str(label[0][9:]), float(like[0]))
+                self._cache[key] = result
+                for i in positions:
+                    results[i] = result
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+
+        for result, netloc in zip(results, netlocs):
+            self._remember(netloc, *result)
+        return results
+
+    def predict(self, text: str, netloc: str | None = None) -> tuple[str, float]:
+        return self.predict_many([text], [netloc])[0]
+
+
+class AsyncLangBatcher:
+    """
+    异步语言检测批处理
+    把同时到来的检测请求攒成一批，凑满max_batch条或等待max_delay秒后一起预测
+    """
+
+    def __init__(self, detector: LangDetector, max_batch: int = 64, max_delay: float = 0.005):
+        self._detector = detector
+        self._max_batch = max_batch
+        self._max_delay = max_delay
+        self._pending: list[tuple[str, str | None, asyncio.Future]] = []
+        self._timer: asyncio.TimerHandle | None = None
+
+    async def predict(self, text: str, netloc: str | None = None) -> tuple[str, float]:
+        host = self._detector.host_lang(netloc)
+        if host is not None:
+            return host
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, netloc, future))
+        if len(self._pending) >= self._max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self._max_delay, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending, self._pending = self._pending, []
+        if not pending:
+            return
+        try:
+            results = self._detector.predict_many([item[0] for item in pending], [item[1] for item in pending])
+        except Exception as e:
+            for _, _, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, _, future), result in zip(pending, results):
+            if not future.done():
+                future.set_result(result)
+
+
+def get_lang_detector() -> LangDetector:
+    """
+    返回本进程的语言检测器，第一次调用时加载模型，爬虫启动时调用一次即可避免首个页面的加载延迟
+    """
+    global _lang_detector
+    if _lang_detector is None:
+        _lang_detector = LangDetector()
+    return _lang_detector
+
+
+def check_lang(s: str, netloc: str | None = None) -> tuple[str, float]:
+    return get_lang_detector().predict(s, netloc)
 
 
 class Schedule:
@@ -163,13 +308,134 @@ class Memory:
                 "APM": memory_status.ullAvailPhys,
             }
             return meminfo
+        if os.path.exists('/proc/meminfo'):
+            fields = {}
+            with open('/proc/meminfo') as f:
+                for line in f:
+                    name, value = line.split(':', 1)
+                    fields[name] = int(value.split()[0]) * 1024
+            available = fields.get('MemAvailable', fields.get('MemFree', 0) + fields.get('Cached', 0))
+            return {
+                "TPM": fields['MemTotal'],
+                "APM": available,
+            }
         return False
 
+    @staticmethod
+    def get_rss() -> int | None:
+        """
+        :return: 当前进程占用的物理内存（字节），无法获取时返回None
+        """
+        if os.path.exists('/proc/self/status'):
+            with open('/proc/self/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        return int(line.split()[1]) * 1024
+        return None
+
+    @staticmethod
+    def get_socket_count() -> int | None:
+        """
+        :return: 当前进程打开的socket数，无法获取时返回None
+        """
+        if not os.path.isdir('/proc/self/fd'):
+            return None
+        count = 0
+        for fd in os.listdir('/proc/self/fd'):
+            try:
+                if os.readlink(f'/proc/self/fd/{fd}').startswith('socket:'):
+                    count += 1
+            except OSError:
+                continue
+        return count
+
     def canuse_memory_percentage(self) -> int:
         memory_info = self.get_memory_info()
         return round((memory_info['APM'] / (1024 ** 3)) / (memory_info['TPM'] / (1024 ** 3)), 3)
 
 
+class ResourceGovernor:
+    """
+    资源调节器
+    后台线程每interval秒采样一次可用内存比例、进程RSS和打开的socket数，据此计算允许的并发数limit。
+    可用内存比例从low_memory降到min_memory的过程中，并发数从max_concurrency线性降到1；
+    RSS和socket数超过上限的80%后同样开始降低。limit每次只向目标值移动一半，避免抖动。
+    热路径中只读取limit和pressure，不会阻塞。
+    """
+
+    def __init__(self, max_concurrency: int, low_memory: float = 0.2, min_memory: float = 0.05,
+                 max_rss: int = 0, max_sockets: int = 0, interval: float = 2, enabled: bool = True):
+        """
+        :param max_concurrency: 资源充足时的并发数
+        :param low_memory: 可用内存比例低于该值时开始降低并发
+        :param min_memory: 可用内存比例低于该值时只保留1个并发
+        :param max_rss: 进程RSS上限（字节），0为不限制
+        :param max_sockets: 打开的socket数上限，0为不限制
+        :param interval: 采样间隔（秒）
+        :param enabled: 为False时不采样，limit始终为max_concurrency
+        """
+        if not (0 <= min_memory < low_memory < 1):
+            raise ValueError("内存比例需满足 0 <= min_memory < low_memory < 1")
+        self.max_concurrency = max_concurrency
+        self.limit = max_concurrency
+        self.pressure = 0.0
+        self._low_memory = low_memory
+        self._min_memory = min_memory
+        self._max_rss = max_rss
+        self._max_sockets = max_sockets
+        self._interval = interval
+        self._enabled = enabled
+        self._stopped = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> 'ResourceGovernor':
+        if self._enabled and self._thread is None:
+            self.sample()
+            self._thread = threading.Thread(target=self._run, name='resource-governor', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self._interval):
+            try:
+                self.sample()
+            except Exception as e:
+                logger.error(f'资源采样出错：{e}')
+
+    @staticmethod
+    def _ramp(value: float, start: float, end: float) -> float:
+        """
+        value从start变化到end时，返回值从0线性变化到1
+        """
+        return min(max((value - start) / (end - start), 0.0), 1.0)
+
+    def sample(self) -> None:
+        pressures = [0.0]
+        memory_info = Memory.get_memory_info()
+        if memory_info:
+            pressures.append(self._ramp(memory_info['APM'] / memory_info['TPM'], self._low_memory, self._min_memory))
+        if self._max_rss:
+            rss = Memory.get_rss()
+            if rss is not None:
+                pressures.append(self._ramp(rss, self._max_rss * 0.8, self._max_rss))
+        if self._max_sockets:
+            sockets = Memory.get_socket_count()
+            if sockets is not None:
+                pressures.append(self._ramp(sockets, self._max_sockets * 0.8, self._max_sockets))
+
+        self.pressure = max(pressures)
+        target = max(1, round(self.max_concurrency * (1 - self.pressure)))
+        limit = round((self.limit + target) / 2)
+        if abs(limit - target) <= 1:
+            limit = target
+        if limit < self.limit:
+            logger.warning(f'资源紧张（{self.pressure:.2f}），并发数降为{limit}')
+        self.limit = limit
+
+
 class ParserLink:
     def __init__(self, url):
         self.netloc = None
@@ -187,12 +453,27 @@ class ParserLink:
 class BloomFilter:
     """
     布隆过滤器
+    位数组保存在文件中并通过mmap映射，添加数据时直接修改映射的内存，由操作系统负责写回，
+    每flush_interval次添加或调用flush()时同步到磁盘并更新文件头。
+    文件头有两个槽位交替写入，每个槽位带有序号和校验值，写入中途崩溃时仍可从另一个槽位恢复。
+    哈希位置由mmh3的128位摘要拆成两个64位整数h1、h2，第i个位置为 (h1 + i * h2) % 位数组大小，
+    add_many() / contains_many() 用NumPy一次算出整批链接的所有位置。
     """
 
-    def __init__(self, data_size: int, error_rate: float = 0.001):
+    _magic = b'TYBLOOM\0'
+    _version = 2
+    _header_size = 4096  # 文件头大小，位数组从这里开始，保持页对齐
+    _slot_size = 64
+    # magic, version, seq, bit_num, hash_num, data_size, error_rate, data_count
+    _slot_struct = struct.Struct('<8sIQQQQdQ')
+
+    def __init__(self, data_size: int, error_rate: float = 0.001, file_name: str | None = 'bloom.bin',
+                 flush_interval: int = 1000):
         """
         :param data_size: 所需存放数据的数量
         :param error_rate:  误报率，默认0.001
+        :param file_name: ./temp下的文件名，为None时只保存在内存中
+        :param flush_interval: 每添加多少条数据同步一次磁盘
         """
 
         if not data_size > 0:
@@ -202,42 +483,139 @@ class BloomFilter:
 
         self._data_size = data_size
         self._error_rate = error_rate
-        self._file_name = 'bloom.pkl'
+        self._file_name = file_name
+        self._flush_interval = flush_interval
 
         self._init_filter()
 
     def _init_filter(self) -> None:
-        try:
-            with open(f'./temp/{self._file_name}', 'rb') as file:
-                data = pickle.load(file)
-            self.__dict__.update(data)
-
-        except (FileNotFoundError, pickle.UnpicklingError):
-            bit_num, hash_num = self._adjust_param(self._data_size, self._error_rate)
-            self._bit_array = bitarray.bitarray(bit_num)
-            self._bit_array.setall(0)
-            self._bit_num = bit_num
-            self._hash_num = hash_num
-
-            # 将哈希种子固定为 1 - hash_num （预留持久化过滤的可能）
-            self._hash_seed = [i for i in range(1, hash_num + 1)]
+        self._bit_num, self._hash_num = self._adjust_param(self._data_size, self._error_rate)
+
+        # 已存数据量
+        self._data_count: int = 0
+        self._seq = 0
+        self._dirty = 0
+        self._closed = False
+
+        if self._file_name is None:
+            self._file = None
+            self._mmap = mmap.mmap(-1, self._header_size + (self._bit_num + 7) // 8)
+        else:
+            os.makedirs('./temp', exist_ok=True)
+            path = f'./temp/{self._file_name}'
+            created = not os.path.exists(path)
+            self._file = open(path, 'w+b' if created else 'r+b')
+            if not created and not self._load_header():
+                logger.warning(f'布隆过滤器文件{path}与当前参数不符或已损坏，将重新创建')
+                created = True
+            size = self._header_size + (self._bit_num + 7) // 8
+            if created:
+                self._file.seek(0)
+                self._file.truncate(0)
+                self._file.truncate(size)
+            self._mmap = mmap.mmap(self._file.fileno(), size)
+            if created:
+                self._write_header()
+
+        self._view = memoryview(self._mmap)[self._header_size:]
+        self._bit_array = bitarray.bitarray(buffer=self._view)
+        self._bytes = np.frombuffer(self._view, dtype=np.uint8)
+        atexit.register(self.close)
+
+    def _load_header(self) -> bool:
+        """
+        读取两个槽位中有效且序号最大的文件头，数据量和误报率一致时恢复已存数据量
+        位数组大小和哈希函数个数以文件头为准，旧版本按其他方式计算参数建立的文件可继续使用
+        """
+        self._file.seek(0)
+        header = self._file.read(self._slot_size * 2)
+        best = None
+        for i in range(2):
+            slot = header[i * self._slot_size:(i + 1) * self._slot_size]
+            fields = self._unpack_slot(slot)
+            if fields and (best is None or fields[2] > best[2]):
+                best = fields
+        if best is None:
+            return False
+        _, version, seq, bit_num, hash_num, data_size, error_rate, data_count = best
+        if version != self._version or data_size != self._data_size or error_rate != self._error_rate:
+            return False
+        self._file.seek(0, os.SEEK_END)
+        if self._file.tell() != self._header_size + (bit_num + 7) // 8:
+            return False
+        self._bit_num = bit_num
+        self._hash_num = hash_num
+        self._seq = seq
+        self._data_count = data_count
+        return True
 
-            # 已存数据量
-            self._data_count: int = 0
-            self._save_state()
+    def _unpack_slot(self, slot: bytes) -> tuple | None:
+        body_size = self._slot_struct.size
+        if len(slot) < body_size + 4:
+            return None
+        body, crc = slot[:body_size], slot[body_size:body_size + 4]
+        if zlib.crc32(body).to_bytes(4, 'little') != crc:
+            return None
+        fields = self._slot_struct.unpack(body)
+        if fields[0] != self._magic:
+            return None
+        return fields
+
+    def _write_header(self) -> None:
+        self._seq += 1
+        body = self._slot_struct.pack(self._magic, self._version, self._seq, self._bit_num, self._hash_num,
+                                      self._data_size, self._error_rate, self._data_count)
+        offset = (self._seq % 2) * self._slot_size
+        self._mmap[offset:offset + len(body) + 4] = body + zlib.crc32(body).to_bytes(4, 'little')
+        self._mmap.flush(0, self._header_size)
+
+    def flush(self) -> None:
+        """
+        先将位数组同步到磁盘，再写入文件头，保证文件头记录的数据量不会多于位数组中已写入的数据
+        """
+        if self._closed or self._file is None:
+            return
+        self._mmap.flush()
+        self._write_header()
+        self._dirty = 0
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self.flush()
+        self._closed = True
+        del self._bit_array
+        del self._bytes
+        self._view.release()
+        self._mmap.close()
+        if self._file is not None:
+            self._file.close()
+        atexit.unregister(self.close)
+
+    def _indexes(self, key: str) -> list[int]:
+        digest = mmh3.hash_bytes(key)
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little')
+        return [((h1 + times * h2) & _UINT64_MASK) % self._bit_num for times in range(self._hash_num)]
+
+    def _batch_indexes(self, keys: list[str]) -> np.ndarray:
+        """
+        :return: 形状为 (len(keys), hash_num) 的哈希位置矩阵
 
-    @cost_time
-    def _save_state(self) -> None:
-        with open(f'./temp/{self._file_name}', 'wb') as file:
-            pickle.dump(self.__dict__, file)
+        与_indexes相同的计算方式，uint64运算溢出即为对2^64取模
+        """
+        digests = np.frombuffer(b''.join(mmh3.hash_bytes(key) for key in keys), dtype='<u8').reshape(-1, 2)
+        times = np.arange(self._hash_num, dtype=np.uint64)
+        return (digests[:, :1] + times * digests[:, 1:]) % np.uint64(self._bit_num)
 
     def add(self, key: str) -> bool:
-        for times in range(self._hash_num):
-            key_hashed_idx = mmh3.hash(key, self._hash_seed[times]) % self._bit_num
+        for key_hashed_idx in self._indexes(key):
             self._bit_array[key_hashed_idx] = 1
 
         self._data_count += 1
-        self._save_state()
+        self._dirty += 1
+        if self._dirty >= self._flush_interval:
+            self.flush()
         return True
 
     def _contains(self, key: str) -> bool:
@@ -245,29 +623,69 @@ class BloomFilter:
         判断该值是否存在
         有任意一位为0 则肯定不存在
         """
-        for times in range(self._hash_num):
-            key_hashed_idx = mmh3.hash(key, self._hash_seed[times]) % self._bit_num
+        for key_hashed_idx in self._indexes(key):
             if not self._bit_array[key_hashed_idx]:
                 return False
         return True
 
+    def contains_many(self, keys: list[str]) -> np.ndarray:
+        """
+        :return: 与keys等长的布尔数组，True表示该值可能已存在
+
+        批量判断，位数组为大端序，第idx位在第idx >> 3个字节的第7 - (idx & 7)位
+        """
+        if not keys:
+            return np.zeros(0, dtype=bool)
+        idx = self._batch_indexes(keys)
+        bits = (self._bytes[idx >> np.uint64(3)] >> (np.uint64(7) - (idx & np.uint64(7))).astype(np.uint8)) & 1
+        return bits.all(axis=1)
+
+    def add_many(self, keys: list[str]) -> np.ndarray:
+        """
+        :return: 与keys等长的布尔数组，True表示该值是本次新加入的
+
+        批量添加，已存在的值和同一批中重复出现的值不计入已存数据量
+        """
+        if not keys:
+            return np.zeros(0, dtype=bool)
+        added = ~self.contains_many(keys)
+        seen = set()
+        for i, key in enumerate(keys):
+            if key in seen:
+                added[i] = False
+            seen.add(key)
+
+        idx = self._batch_indexes(keys).ravel()
+        masks = (np.uint8(1) << (np.uint64(7) - (idx & np.uint64(7))).astype(np.uint8)).astype(np.uint8)
+        np.bitwise_or.at(self._bytes, idx >> np.uint64(3), masks)
+
+        count = int(added.sum())
+        self._data_count += count
+        self._dirty += count
+        if self._dirty >= self._flush_interval:
+            self.flush()
+        return added
+
     def copy(self) -> 'BloomFilter':
         """
-        :return: 返回一个完全相同的布隆过滤器实例
+        :return: 返回一个完全相同的布隆过滤器实例（只保存在内存中）
 
         复制一份布隆过滤器的实例
         """
-        new_filter = BloomFilter(self._data_size, self._error_rate)
+        new_filter = BloomFilter(self._data_size, self._error_rate, file_name=None)
         return self._copy_param(new_filter)
 
     def _copy_param(self, filter: 'BloomFilter') -> 'BloomFilter':
-        filter._bit_array = copy.deepcopy(self._bit_array)
-        filter._bit_num = self._bit_num
-        filter._hash_num = self._hash_num
-        filter._hash_seed = copy.deepcopy(self._hash_seed)
+        filter._mmap[filter._header_size:] = self._mmap[self._header_size:]
         filter._data_count = self._data_count
         return filter
 
+    def __enter__(self) -> 'BloomFilter':
+        return self
+
+    def __exit__(self, exc_type: Any, exc_val: Any, exc_tb: Any) -> None:
+        self.close()
+
     @staticmethod
     def _adjust_param(data_size: int, error_rate: float) -> tuple[int, int]:
         """
@@ -278,15 +696,16 @@ class BloomFilter:
         通过数据量和期望的误报率 计算出 位数组大小 和 哈希函数的数量
         k为哈希函数个数    m为位数组大小
         n为数据量          p为误报率
-        m = - (n * lnp) / (ln2)^2
+        k = -log2(p)，取整
 
-        k = (m / n) * ln2
+        误报率 (1 - e^(-kn/m))^k = p，得 m = - k * n / ln(1 - p^(1/k))，向上取整
+        直接取整最优的m、k会使实际误报率略高于p，先确定整数k再计算m，保证存满n个数据时误报率不超过p
         """
         p = error_rate
         n = data_size
-        m = - (n * (math.log(p, math.e)) / (math.log(2, math.e)) ** 2)
-        k = m / n * math.log(2, math.e)
-        return int(m), int(k)
+        k = max(round(-math.log2(p)), 1)
+        m = math.ceil(-k * n / math.log(1 - p ** (1 / k)))
+        return m, k
 
     def __len__(self) -> int:
         """"
@@ -296,3 +715,120 @@ class BloomFilter:
 
     def __contains__(self, key) -> bool:
         return self._contains(key)
+
+
+class ScalableBloomFilter:
+    """
+    可扩展布隆过滤器
+    由多个布隆过滤器切片组成，当前切片的已存数据量达到容量时新增一个切片，
+    新切片容量为上一个的growth倍，误报率为上一个的tightening倍，
+    整体误报率不超过 error_rate（各切片误报率之和为等比数列）。
+    """
+
+    def __init__(self, initial_size: int, error_rate: float = 0.001, file_name: str | None = 'bloom',
+                 growth: int = 2, tightening: float = 0.5, flush_interval: int = 1000):
+        """
+        :param initial_size: 第一个切片的容量
+        :param error_rate: 整体误报率
+        :param file_name: 切片文件名前缀，第i个切片保存在./temp/{file_name}-{i}.bin，为None时只保存在内存中
+        :param growth: 切片容量增长倍数
+        :param tightening: 切片误报率收紧比例
+        :param flush_interval: 每添加多少条数据同步一次磁盘
+        """
+        if not (0 < tightening < 1):
+            raise ValueError("收紧比例需在0到1之间")
+        if growth < 1:
+            raise ValueError("增长倍数不能小于1")
+
+        self._initial_size = initial_size
+        self._error_rate = error_rate
+        self._file_name = file_name
+        self._growth = growth
+        self._tightening = tightening
+        self._flush_interval = flush_interval
+        self._filters: list[BloomFilter] = []
+
+        # 按顺序加载已存在的切片
+        self._add_slice()
+        while self._file_name is not None and os.path.exists(f'./temp/{self._slice_name(len(self._filters))}'):
+            self._add_slice()
+
+    def _slice_name(self, i: int) -> str | None:
+        if self._file_name is None:
+            return None
+        return f'{self._file_name}-{i}.bin'
+
+    def _add_slice(self) -> BloomFilter:
+        i = len(self._filters)
+        bloom = BloomFilter(
+            self._initial_size * self._growth ** i,
+            self._error_rate * (1 - self._tightening) * self._tightening ** i,
+            file_name=self._slice_name(i),
+            flush_interval=self._flush_interval
+        )
+        self._filters.append(bloom)
+        return bloom
+
+    def _current(self) -> BloomFilter:
+        bloom = self._filters[-1]
+        if len(bloom) >= bloom._data_size:
+            bloom.flush()
+            bloom = self._add_slice()
+        return bloom
+
+    def add(self, key: str) -> bool:
+        """
+        :return: 是否为新加入的值
+        """
+        if key in self:
+            return False
+        return self._current().add(key)
+
+    def contains_many(self, keys: list[str]) -> np.ndarray:
+        result = np.zeros(len(keys), dtype=bool)
+        for bloom in self._filters:
+            result |= bloom.contains_many(keys)
+        return result
+
+    def add_many(self, keys: list[str]) -> np.ndarray:
+        """
+        :return: 与keys等长的布尔数组，True表示该值是本次新加入的
+        """
+        added = ~self.contains_many(keys)
+        seen = set()
+        new_keys = []
+        for i, key in enumerate(keys):
+            if added[i] and key not in seen:
+                seen.add(key)
+                new_keys.append(key)
+            else:
+                added[i] = False
+
+        # 按当前切片剩余容量分批写入，写满后再新增切片
+        start = 0
+        while start < len(new_keys):
+            bloom = self._current()
+            end = start + max(bloom._data_size - len(bloom), 1)
+            bloom.add_many(new_keys[start:end])
+            start = end
+        return added
+
+    def flush(self) -> None:
+        for bloom in self._filters:
+            bloom.flush()
+
+    def close(self) -> None:
+        for bloom in self._filters:
+            bloom.close()
+
+    def __enter__(self) -> 'ScalableBloomFilter':
+        return self
+
+    def __exit__(self, exc_type: Any, exc_val: Any, exc_tb: Any) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return sum(len(bloom) for bloom in self._filters)
+
+    def __contains__(self, key) -> bool:
+        return any(key in bloom for bloom in self._filters)